@@ -1,17 +1,17 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from quantum import BikeRentalSimulation
 import json
-from gemini_service import get_all_explanations
+from gemini_service import (PREWARM_EXPLANATIONS, get_all_explanations, get_explanation_job,
+                            prewarm_explanations, submit_explanation_job)
+from web import (create_registry, create_simulation, ensemble_response, forecast_response,
+                 session_id, station_response, step_response, stream_response)
 
 #APP.py
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Initialize the simulation
-simulation = BikeRentalSimulation(num_stations=20, num_bikes=250)
-simulation.initialize_system()
+registry = create_registry(create_simulation)
 
 @app.route('/api/explain', methods=['POST'])
 def explain_simulation():
@@ -20,7 +20,13 @@ def explain_simulation():
     explanation_type = data.get('type', 'both')  # 'technical', 'non-technical', or 'both'
     
     # Get current simulation state for context
-    simulation_state = json.loads(simulation.export_simulation_data())
+    with registry.session(session_id()) as simulation:
+        simulation_state = simulation.get_station_info()
+    
+    # Asynchronous mode: hand back a job id at once and let the client poll for it
+    if data.get('async'):
+        job_id = submit_explanation_job(explanation_type, simulation_state)
+        return jsonify({'job': job_id, 'status': 'pending'}), 202
     
     try:
         # Get explanations from the Gemini service
@@ -41,25 +47,30 @@ def explain_simulation():
             }
         }), 500
 
+@app.route('/api/explain/<job_id>', methods=['GET'])
+def explanation_job(job_id):
+    """Poll a background explanation job; ?wait=<seconds> long-polls until it finishes."""
+    job = get_explanation_job(job_id, wait_seconds=min(request.args.get('wait', 0, type=float), 30))
+    if job is None:
+        return jsonify({'error': f'Unknown explanation job: {job_id}'}), 404
+    return jsonify(job)
+
 @app.route('/api/init', methods=['GET'])
 def initialize_simulation():
     """Initialize or reset the simulation with default parameters."""
-    global simulation
-    simulation = BikeRentalSimulation(num_stations=20, num_bikes=250)
-    simulation.initialize_system()
-    return jsonify(json.loads(simulation.export_simulation_data()))
+    simulation = create_simulation()
+    registry.replace(session_id(), simulation)
+    return station_response(simulation)
 
 @app.route('/api/config', methods=['POST'])
 def configure_simulation():
     """Configure the simulation with custom parameters."""
-    global simulation
     data = request.json
     
     num_stations = data.get('numStations', 20)
     num_bikes = data.get('numBikes', 250)
     
-    simulation = BikeRentalSimulation(num_stations=num_stations, num_bikes=num_bikes)
-    simulation.initialize_system()
+    simulation = create_simulation(num_stations=num_stations, num_bikes=num_bikes)
     
     if 'weather' in data:
         simulation.set_weather(data['weather'])
@@ -68,7 +79,8 @@ def configure_simulation():
         simulation.current_time = data['time'] % 24
         simulation.apply_time_and_weather_factors()
     
-    return jsonify(json.loads(simulation.export_simulation_data()))
+    registry.replace(session_id(), simulation)
+    return station_response(simulation)
 
 @app.route('/api/step', methods=['POST'])
 def simulation_step():
@@ -76,44 +88,90 @@ def simulation_step():
     data = request.json
     use_quantum = data.get('useQuantum', True)
     
-    if use_quantum:
-        simulation.run_quantum_step()
-    else:
-        simulation.run_classical_step()
-    
-    return jsonify(json.loads(simulation.export_simulation_data()))
+    with registry.session(session_id()) as simulation:
+        previous_distribution = simulation.current_distribution.copy()
+        
+        if use_quantum:
+            simulation.run_quantum_step()
+        else:
+            simulation.run_classical_step()
+        
+        # Each bike counts twice (once leaving, once arriving)
+        movement = int(abs(simulation.current_distribution - previous_distribution).sum()) // 2
+        
+        if data.get('prewarmExplanations', PREWARM_EXPLANATIONS):
+            prewarm_explanations(simulation.get_station_info())
+        return step_response(simulation, {'movement': movement})
 
 @app.route('/api/advance_time', methods=['POST'])
 def advance_time():
     """Advance the simulation time."""
     data = request.json
     hours = data.get('hours', 1)
-    simulation.advance_time(hours)
-    return jsonify(json.loads(simulation.export_simulation_data()))
+    with registry.session(session_id()) as simulation:
+        simulation.advance_time(hours)
+        return station_response(simulation)
 
 @app.route('/api/set_weather', methods=['POST'])
 def set_weather():
     """Set the current weather condition."""
     data = request.json
     weather = data.get('weather', 'sunny')
-    success = simulation.set_weather(weather)
-    return jsonify({
-        'success': success,
-        'data': json.loads(simulation.export_simulation_data())
-    })
+    with registry.session(session_id()) as simulation:
+        success = simulation.set_weather(weather)
+        # Splice in the cached snapshot bytes rather than re-serializing the state
+        body = b'{"success": %s, "data": %s}' % (json.dumps(success).encode(), simulation.snapshot_json())
+    return Response(body, mimetype='application/json')
 
 @app.route('/api/simulate_day', methods=['POST'])
 def simulate_day():
     """Simulate a full day of bike rentals."""
     data = request.json
     use_quantum = data.get('useQuantum', True)
-    results = simulation.simulate_day(use_quantum)
+    with registry.session(session_id()) as simulation:
+        results = simulation.simulate_day(use_quantum)
+        if data.get('prewarmExplanations', PREWARM_EXPLANATIONS):
+            prewarm_explanations(simulation.get_station_info())
     return jsonify(results)
 
+@app.route('/api/simulate_day_stream', methods=['POST'])
+def simulate_day_stream():
+    """Stream each simulated hour as soon as its step finishes."""
+    data = request.json
+    use_quantum = data.get('useQuantum', True)
+    hours = data.get('hours', 24)
+    return stream_response(registry, hours, use_quantum)
+
+@app.route('/api/forecast', methods=['GET'])
+def forecast():
+    """Forecast the expected distribution ?hours=<n> ahead (default 6) without sampling."""
+    hours = request.args.get('hours', 6, type=int)
+    return forecast_response(registry, hours)
+
+@app.route('/api/stationary', methods=['GET'])
+def stationary():
+    """Long-run distribution and mixing time for ?time=<hour>&weather=<w> (defaults to the current ones)."""
+    hour = request.args.get('time', type=int)
+    weather = request.args.get('weather')
+    
+    with registry.session(session_id()) as simulation:
+        if weather is not None and weather not in simulation.weather_factors:
+            return jsonify({'error': f'Invalid weather: {weather}'}), 400
+        return jsonify(simulation.stationary_distribution(hour, weather))
+
+@app.route('/api/simulate_day_ensemble', methods=['POST'])
+def simulate_day_ensemble():
+    """Simulate many replicas of a day and return per-station statistics."""
+    data = request.json
+    replicas = data.get('replicas', 1000)
+    hours = data.get('hours', 24)
+    use_quantum = data.get('useQuantum', False)
+    return ensemble_response(registry, replicas, hours, use_quantum)
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get the current status of the simulation."""
-    return jsonify(json.loads(simulation.export_simulation_data()))
+    return registry.read(session_id(), station_response)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -1,4 +1,12 @@
+import json
 import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import numpy as np
 from google import genai
 from google.genai import types  # Import types for configuration
 from google.genai.types import HttpOptions
@@ -20,6 +28,23 @@ GENERATION_CONFIG = types.GenerateContentConfig(
     max_output_tokens=1024
 )
 
+# Configuration for combined mode: one call returning both explanations as JSON
+COMBINED_GENERATION_CONFIG = types.GenerateContentConfig(
+    temperature=0.7,
+    top_p=1,
+    top_k=32,
+    max_output_tokens=2048,
+    response_mime_type="application/json",
+    response_schema=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "technical": types.Schema(type=types.Type.STRING),
+            "non_technical": types.Schema(type=types.Type.STRING)
+        },
+        required=["technical", "non_technical"]
+    )
+)
+
 def generate_technical_prompt(simulation_state):
     """Generate a technical explanation prompt for the simulation."""
     num_stations = len(simulation_state.get('stations', []))
@@ -126,123 +151,634 @@ def generate_non_technical_prompt(simulation_state):
     Write your explanation in a friendly, accessible style without any special formatting characters (no asterisks, stars or numbered lists). Use everyday examples that make the concepts easy to understand.
     """
 
+def generate_combined_prompt(simulation_state):
+    """Generate a single prompt asking for both explanations, sharing the simulation context."""
+    num_stations = len(simulation_state.get('stations', []))
+    total_bikes = simulation_state.get('total_bikes', 0)
+    current_time = simulation_state.get('time', 0)
+    weather = simulation_state.get('weather', 'unknown')
+    
+    # Calculate statistics
+    station_bikes = [s.get('bikes', 0) for s in simulation_state.get('stations', [])]
+    mean = sum(station_bikes)/len(station_bikes) if station_bikes else 0
+    variance = sum((b - mean)**2 for b in station_bikes) / len(station_bikes) if station_bikes else 0
+    std_dev = variance**0.5 if variance > 0 else 0
+    cv = std_dev / mean if mean > 0 else 0
+    
+    return f"""
+    NYC bike-sharing data: {num_stations} stations, {total_bikes} bikes, at {current_time}:00 during {weather} conditions.
+    Current statistics: mean bikes per station: {mean:.1f}, variance: {variance:.2f}, standard deviation: {std_dev:.2f}, CV: {cv:.2f}
+    
+    Return two explanations of this state.
+    
+    "technical": a clear technical analysis that:
+    1. Evaluates the current distribution balance using statistical measures
+    2. Identifies stations with potential supply issues
+    3. Explains quantum random walk advantages over classical algorithms
+    4. Suggests optimization strategies based on current patterns
+    Keep it concise, well-structured, and focused on quantitative insights.
+    
+    "non_technical": in simple, conversational language:
+    1. How well is the system currently performing?
+    2. Which neighborhoods might have bike shortages or surpluses?
+    3. How does quantum prediction help improve the system?
+    4. What practical improvements would make the rider experience better?
+    Use a friendly, accessible style with everyday examples.
+    
+    Neither explanation should contain asterisks, stars or other formatting symbols.
+    """
+
+# Model used for every explanation
+MODEL_NAME = "gemini-2.0-flash"
 
-def get_explanation(prompt_type, simulation_state):
+# Explanations are reused for this long, and at most this many are kept
+EXPLANATION_CACHE_TTL = 600
+EXPLANATION_CACHE_SIZE = 256
+
+# Seconds /api/explain waits for its explanations before returning what is ready
+EXPLANATION_TIMEOUT = 30
+
+# Threads generating explanations concurrently across all requests
+EXPLANATION_WORKERS = 8
+
+# Background explanation jobs: concurrent jobs, and finished jobs kept for polling
+EXPLANATION_JOB_WORKERS = 2
+EXPLANATION_JOB_LIMIT = 256
+
+# Outbound model calls: sustained rate, burst size, and how many may be waiting
+# for the rate limit (or running) before further ones are shed. The same bound
+# applies to generations queued for the explanation workers.
+MODEL_CALLS_PER_SECOND = 2
+MODEL_CALL_BURST = 5
+MAX_PENDING_MODEL_CALLS = 16
+MODEL_CALL_QUEUE_TIMEOUT = 10
+
+# Whether stepping endpoints pre-generate explanations for the new state by default
+PREWARM_EXPLANATIONS = os.getenv("PREWARM_EXPLANATIONS") == "1"
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Get the shared Gemini client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = genai.Client(api_key=api_key, http_options=HttpOptions(api_version="v1"))
+        return _client
+
+def set_client(client):
     """
-    Get an explanation from Gemini based on the prompt type and simulation state.
+    Replace the shared client, e.g. with a FakeClient to run offline.
+    
+    Args:
+        client: Object with a models.generate_content(model=, contents=, config=) method
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+class FakeClient:
+    """Local stand-in for genai.Client that answers without calling the API."""
+    
+    class _Response:
+        def __init__(self, text):
+            self.text = text
+    
+    def __init__(self, text="Fake explanation.", latency=0.0):
+        """
+        Args:
+            text: Text of every response, or a callable taking the prompt
+            latency: Seconds each call sleeps before answering
+        """
+        self.text = text
+        self.latency = latency
+        self.calls = 0
+        self.models = self
+    
+    def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.text(contents[0]) if callable(self.text) else self.text
+        return self._Response(text)
+
+def state_fingerprint(simulation_state):
+    """
+    Quantize a simulation state so that effectively identical states share explanations.
     
     Args:
-        prompt_type: Either 'technical' or 'non-technical'
         simulation_state: Current state of the simulation
         
     Returns:
-        A string containing the explanation, or an error message if generation fails.
+        A hashable tuple of time, weather, total bikes and bucketed distribution statistics.
     """
-    logger.info('Getting explanation')
+    stations = simulation_state.get('stations', [])
+    bikes = np.array([s.get('bikes', 0) for s in stations], dtype=float)
+    capacities = np.array([s.get('capacity', 0) for s in stations], dtype=float)
+    
+    mean = bikes.mean() if len(bikes) else 0.0
+    std = bikes.std() if len(bikes) else 0.0
+    return (
+        simulation_state.get('time', 0),
+        simulation_state.get('weather', 'unknown'),
+        simulation_state.get('total_bikes', 0),
+        len(stations),
+        round(mean * 2) / 2,                     # Mean bikes per station, to 0.5
+        round(std),                              # Spread, to whole bikes
+        int(np.sum(bikes == 0)),                 # Empty stations
+        int(np.sum((bikes >= capacities) & (capacities > 0)))  # Full stations
+    )
+
+class ExplanationCache:
+    """Thread-safe LRU cache of explanations whose entries expire after a TTL."""
+    
+    def __init__(self, max_entries=EXPLANATION_CACHE_SIZE, ttl=EXPLANATION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """Get a cached explanation, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def put(self, key, explanation):
+        """Store an explanation, evicting the least recently used ones over the size limit."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), explanation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def contains(self, key):
+        """Whether a live explanation is cached, without counting a lookup."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl
+    
+    def clear(self):
+        """Drop every cached explanation."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Get the hit, miss and eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class ExplanationServiceBusy(Exception):
+    """Raised when a model call is shed because too many are already queued."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the rate of outbound model calls."""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, timeout):
+        """Take a token, waiting up to timeout seconds for one; returns whether it got one."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                delay = (1 - self._tokens) / self.rate
+            
+            if now + delay > deadline:
+                return False
+            time.sleep(delay)
+    
+    def is_full(self):
+        """Whether no tokens have been used recently, i.e. the bucket is back at capacity."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            return self._tokens >= self.capacity
+
+
+explanation_cache = ExplanationCache()
+
+_rate_limit = TokenBucket(MODEL_CALLS_PER_SECOND, MODEL_CALL_BURST)
+_pending_calls = threading.BoundedSemaphore(MAX_PENDING_MODEL_CALLS)
+
+# Generations in progress, keyed like the cache, so identical requests share one
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_service_stats = {'model_calls': 0, 'coalesced': 0, 'shed': 0, 'prewarm_skipped': 0}
+# Model calls holding a pending slot, i.e. waiting for the rate limit or running
+_pending_count = 0
+# Generations submitted to _executor that haven't finished or been cancelled
+_queued_count = 0
+
+_executor = ThreadPoolExecutor(max_workers=EXPLANATION_WORKERS, thread_name_prefix='explain')
+
+# Jobs get their own pool: they wait on _executor and must not starve it
+_job_executor = ThreadPoolExecutor(max_workers=EXPLANATION_JOB_WORKERS, thread_name_prefix='explain-job')
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+# Pre-warming runs on a single thread and only for the latest state
+_prewarm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain-prewarm')
+_prewarm_state = None
+_prewarm_lock = threading.Lock()
+
+def _call_model(client, prompt, config):
+    """
+    Make one rate-limited model call.
+    
+    Raises:
+        ExplanationServiceBusy: If too many calls are queued, or no rate-limit
+            token became available within MODEL_CALL_QUEUE_TIMEOUT.
+    """
+    global _pending_count
+    if not _pending_calls.acquire(blocking=False):
+        _count('shed')
+        raise ExplanationServiceBusy("Explanation service is busy, please try again shortly.")
+    
+    with _in_flight_lock:
+        _pending_count += 1
     try:
-        # Create a client instance, passing in the API key and HTTP options
-        client = genai.Client(api_key=api_key, http_options=HttpOptions(api_version="v1"))
-        
-        # Generate the appropriate prompt based on the type
-        if prompt_type == 'technical':
-            prompt = generate_technical_prompt(simulation_state)
-        else:  # non-technical
-            prompt = generate_non_technical_prompt(simulation_state)
+        if not _rate_limit.acquire(MODEL_CALL_QUEUE_TIMEOUT):
+            _count('shed')
+            raise ExplanationServiceBusy("Explanation service is busy, please try again shortly.")
         
+        _count('model_calls')
         # Generate the content using the updated API with contents as a list
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
+        return (client or get_client()).models.generate_content(
+            model=MODEL_NAME,
             contents=[prompt],
-            config=GENERATION_CONFIG
+            config=config
         )
-        
-        # Return the generated text response
-        logger.info('Explanation generated successfully')
-        return response.text
-        
-    except Exception as e:
-        logger.error(f'Error generating {prompt_type} explanation: {str(e)}')
-        return f"Error generating {prompt_type} explanation: {str(e)}"
+    finally:
+        with _in_flight_lock:
+            _pending_count -= 1
+        _pending_calls.release()
 
-def get_all_explanations(explanation_type, simulation_state):
+def _submit(fn, *args):
     """
-    Get all requested explanations based on the explanation type.
+    Queue a generation on the explanation workers, admitting at most
+    MAX_PENDING_MODEL_CALLS at a time: the executor's own work queue is
+    unbounded, so this is where excess load has to be shed.
+    
+    Raises:
+        ExplanationServiceBusy: If too many generations are already queued.
+    """
+    global _queued_count
+    with _in_flight_lock:
+        if _queued_count >= MAX_PENDING_MODEL_CALLS:
+            _service_stats['shed'] += 1
+            raise ExplanationServiceBusy("Explanation service is busy, please try again shortly.")
+        _queued_count += 1
+    
+    future = _executor.submit(fn, *args)
+    # Also called when the future is cancelled before it ran
+    future.add_done_callback(_generation_done)
+    return future
+
+def _generation_done(future):
+    """Release the queue slot of a generation submitted by _submit()."""
+    global _queued_count
+    with _in_flight_lock:
+        _queued_count -= 1
+
+def _limiter_idle():
+    """Whether no generation is queued or pending and the rate limit has its full burst available."""
+    with _in_flight_lock:
+        if _pending_count or _queued_count:
+            return False
+    return _rate_limit.is_full()
+
+def _count(name):
+    """Increment one of the service counters."""
+    with _in_flight_lock:
+        _service_stats[name] += 1
+
+def _single_flight(key, generate, *args):
+    """
+    Run generate(*args), or wait for the identical generation already in flight.
     
     Args:
-        explanation_type: 'technical', 'non-technical', or 'both'
-        simulation_state: Current state of the simulation
+        key: Identifies the generation, e.g. (prompt type, state fingerprint)
+        generate: Function producing the result
         
     Returns:
-        A dictionary containing the requested explanations.
+        The result of the generation shared by every concurrent caller.
     """
-    logger.info('Getting all explanations')
-    explanations = {}
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _in_flight[key] = future
+        else:
+            _service_stats['coalesced'] += 1
     
-    if explanation_type in ['technical', 'both']:
-        explanations['technical'] = get_explanation('technical', simulation_state)
-        
-    if explanation_type in ['non-technical', 'both']:
-        explanations['non_technical'] = get_explanation('non-technical', simulation_state)
+    if not leader:
+        return future.result()
     
-    logger.info('All explanations generated successfully')
-    return explanations
+    try:
+        result = generate(*args)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
 
-def get_explanation(prompt_type, simulation_state):
+def service_stats():
+    """Get the explanation cache, coalescing and load shedding counters."""
+    with _in_flight_lock:
+        in_flight = len(_in_flight)
+        queued = _queued_count
+    return dict(_service_stats, in_flight=in_flight, queued=queued, cache=explanation_cache.stats())
+
+def get_explanation(prompt_type, simulation_state, client=None):
     """
     Get an explanation from Gemini based on the prompt type and simulation state.
     
+    Explanations are cached by prompt type and state_fingerprint(), so
+    repeated requests for an effectively unchanged state skip the model.
+    
     Args:
         prompt_type: Either 'technical' or 'non-technical'
         simulation_state: Current state of the simulation
+        client: Optional backend to use instead of the shared client
         
     Returns:
         A string containing the explanation, or an error message if generation fails.
     """
-    print("STEP 2")
+    key = (prompt_type, state_fingerprint(simulation_state))
+    explanation = explanation_cache.get(key)
+    if explanation is not None:
+        return explanation
+    
+    # Concurrent requests for the same explanation share one generation
+    return _single_flight(key, _generate_explanation, key, prompt_type, simulation_state, client)
+
+def _generate_explanation(key, prompt_type, simulation_state, client):
+    """Generate and cache one explanation (see get_explanation)."""
+    # A generation that just finished may have filled the cache
+    if explanation_cache.contains(key):
+        return explanation_cache.get(key)
+    
     try:
-        # Create a client instance, passing in the API key and HTTP options
-        client = genai.Client(api_key=api_key, http_options=HttpOptions(api_version="v1"))
-        
         # Generate the appropriate prompt based on the type
         if prompt_type == 'technical':
             prompt = generate_technical_prompt(simulation_state)
         else:  # non-technical
             prompt = generate_non_technical_prompt(simulation_state)
         
-        # Generate the content using the updated API with contents as a list
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[prompt],
-            config=GENERATION_CONFIG
-        )
+        response = _call_model(client, prompt, GENERATION_CONFIG)
         
-        # Return the generated text response
+        # Only successful explanations are cached; errors are retried next time
+        explanation_cache.put(key, response.text)
         return response.text
         
+    except ExplanationServiceBusy as e:
+        logger.warning(f'Shed {prompt_type} explanation: {str(e)}')
+        return str(e)
     except Exception as e:
         error_message = f"Error generating {prompt_type} explanation: {str(e)}"
-        print(error_message)
+        logger.error(error_message)
         return error_message
 
-def get_all_explanations(explanation_type, simulation_state):
+def get_combined_explanations(simulation_state, client=None):
+    """
+    Get both explanations from a single structured-output model call.
+    
+    Args:
+        simulation_state: Current state of the simulation
+        client: Optional backend to use instead of the shared client
+        
+    Returns:
+        A dictionary with 'technical' and 'non_technical' explanations, or
+        None if the call failed or its response couldn't be parsed.
+        
+    Raises:
+        ExplanationServiceBusy: If the call was shed; falling back to two
+            calls would only add load.
+    """
+    fingerprint = state_fingerprint(simulation_state)
+    return _single_flight(('combined', fingerprint), _generate_combined_explanations,
+                          fingerprint, simulation_state, client)
+
+def _generate_combined_explanations(fingerprint, simulation_state, client):
+    """Generate and cache both explanations in one call (see get_combined_explanations)."""
+    # A generation that just finished may have filled the cache
+    keys = {'technical': ('technical', fingerprint), 'non_technical': ('non-technical', fingerprint)}
+    if all(explanation_cache.contains(key) for key in keys.values()):
+        return {name: explanation_cache.get(key) for name, key in keys.items()}
+    
+    try:
+        response = _call_model(client, generate_combined_prompt(simulation_state), COMBINED_GENERATION_CONFIG)
+        parsed = json.loads(response.text)
+        explanations = {key: parsed[key] for key in ('technical', 'non_technical')}
+        if not all(isinstance(text, str) and text.strip() for text in explanations.values()):
+            raise ValueError('empty explanation in structured response')
+    except ExplanationServiceBusy:
+        raise
+    except Exception as e:
+        logger.warning(f'Combined explanation failed, falling back to separate calls: {str(e)}')
+        return None
+    
+    explanation_cache.put(('technical', fingerprint), explanations['technical'])
+    explanation_cache.put(('non-technical', fingerprint), explanations['non_technical'])
+    return {key: explanations[key] for key in requested}
+
+def get_all_explanations(explanation_type, simulation_state, timeout=EXPLANATION_TIMEOUT, client=None,
+                         combined=True):
     """
     Get all requested explanations based on the explanation type.
     
+    With 'both' and combined set, a single structured call generates both
+    explanations, falling back to separate calls if its response can't be
+    used. Separate explanations are generated concurrently. Any that miss
+    the deadline are reported as timed out while the others are still
+    returned; late ones already running keep going and land in the cache
+    for the next request, while those still queued are cancelled. When too
+    many generations are queued, new ones are shed with a busy message.
+    
     Args:
         explanation_type: 'technical', 'non-technical', or 'both'
         simulation_state: Current state of the simulation
+        timeout: Seconds to wait for the explanations
+        client: Optional backend to use instead of the shared client
+        combined: Whether 'both' may use a single combined model call
         
     Returns:
         A dictionary containing the requested explanations.
     """
+    deadline = time.monotonic() + timeout
+    
+    fingerprint = state_fingerprint(simulation_state)
+    if (explanation_type == 'both' and combined
+            and not explanation_cache.contains(('technical', fingerprint))
+            and not explanation_cache.contains(('non-technical', fingerprint))):
+        try:
+            future = _submit(get_combined_explanations, simulation_state, client)
+        except ExplanationServiceBusy as e:
+            logger.warning(f'Shed combined explanation: {str(e)}')
+            return {'technical': str(e), 'non_technical': str(e)}
+        
+        wait([future], timeout=timeout)
+        if not future.done():
+            future.cancel()
+            logger.warning('Timed out generating combined explanation')
+            return {
+                'technical': "Timed out generating technical explanation.",
+                'non_technical': "Timed out generating non-technical explanation."
+            }
+        try:
+            explanations = future.result()
+        except ExplanationServiceBusy as e:
+            logger.warning(f'Shed combined explanation: {str(e)}')
+            return {'technical': str(e), 'non_technical': str(e)}
+        if explanations is not None:
+            return explanations
+    
+    futures = {}
     explanations = {}
-    print("STEP 1")
     
-    if explanation_type in ['technical', 'both']:
-        explanations['technical'] = get_explanation('technical', simulation_state)
+    requested = [key for key in ('technical', 'non_technical')
+                 if explanation_type in [key.replace('_', '-'), 'both']]
+    for key in requested:
+        prompt_type = key.replace('_', '-')
+        # Cached explanations are answered here and take no queue slot
+        if explanation_cache.contains((prompt_type, fingerprint)):
+            explanations[key] = get_explanation(prompt_type, simulation_state, client)
+            continue
+        try:
+            futures[key] = _submit(get_explanation, prompt_type, simulation_state, client)
+        except ExplanationServiceBusy as e:
+            logger.warning(f'Shed {prompt_type} explanation: {str(e)}')
+            explanations[key] = str(e)
+    
+    wait(futures.values(), timeout=max(deadline - time.monotonic(), 0))
+    
+    for key, future in futures.items():
+        if future.done():
+            explanations[key] = future.result()
+        else:
+            # Nobody else waits on this future, so a queued generation is dropped
+            future.cancel()
+            prompt_type = key.replace('_', '-')
+            logger.warning(f'Timed out generating {prompt_type} explanation')
+            explanations[key] = f"Timed out generating {prompt_type} explanation."
+    
+    return {key: explanations[key] for key in requested}
+
+def submit_explanation_job(explanation_type, simulation_state, client=None):
+    """
+    Start generating explanations in the background.
+    
+    Args:
+        explanation_type: 'technical', 'non-technical', or 'both'
+        simulation_state: Current state of the simulation
+        client: Optional backend to use instead of the shared client
         
-    if explanation_type in ['non-technical', 'both']:
-        explanations['non_technical'] = get_explanation('non-technical', simulation_state)
+    Returns:
+        The id to poll with get_explanation_job().
+    """
+    job_id = uuid.uuid4().hex
+    future = _job_executor.submit(get_all_explanations, explanation_type, simulation_state, client=client)
+    
+    with _jobs_lock:
+        _jobs[job_id] = future
+        # Forget the oldest finished jobs; running ones are always kept
+        for old_id in [jid for jid, job in _jobs.items() if job.done()][:max(len(_jobs) - EXPLANATION_JOB_LIMIT, 0)]:
+            del _jobs[old_id]
     
-    return explanations
+    return job_id
 
+def get_explanation_job(job_id, wait_seconds=0):
+    """
+    Get the status of a background explanation job.
+    
+    Args:
+        job_id: Id returned by submit_explanation_job()
+        wait_seconds: How long to wait for a pending job to finish (long polling)
+        
+    Returns:
+        A dictionary with 'status' ('pending' or 'done') and, once done, the
+        'explanations'; None if the job is unknown.
+    """
+    with _jobs_lock:
+        future = _jobs.get(job_id)
+    if future is None:
+        return None
+    
+    if wait_seconds:
+        wait([future], timeout=wait_seconds)
+    
+    if not future.done():
+        return {'job': job_id, 'status': 'pending'}
+    return {'job': job_id, 'status': 'done', 'explanations': future.result()}
+
+def prewarm_explanations(simulation_state, client=None):
+    """
+    Generate both explanations for a state at low priority so a later request hits the cache.
+    
+    Only one pre-warm runs at a time; states submitted while it is busy
+    replace each other, so just the latest one is generated next. A pre-warm
+    is skipped unless the model-call limiter is idle, so it never uses rate
+    limit tokens or pending slots an interactive request is waiting for.
+    
+    Args:
+        simulation_state: State of the simulation after a step
+        client: Optional backend to use instead of the shared client
+    """
+    global _prewarm_state
+    with _prewarm_lock:
+        pending = _prewarm_state is not None
+        _prewarm_state = (simulation_state, client)
+    if not pending:
+        _prewarm_executor.submit(_run_prewarm)
+
+def _run_prewarm():
+    """Generate explanations for the latest state passed to prewarm_explanations()."""
+    global _prewarm_state
+    with _prewarm_lock:
+        simulation_state, client = _prewarm_state
+        _prewarm_state = None
+    
+    if not _limiter_idle():
+        _count('prewarm_skipped')
+        return
+    get_all_explanations('both', simulation_state, client=client)
\ No newline at end of file
@@ -0,0 +1,197 @@
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+
+import numpy as np
+
+from quantum import summarize_ensemble_hour
+
+# Worker processes are started from a clean server process rather than forked
+# from a multi-threaded web server, whose locks may be held mid-fork
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Largest ensemble a request may ask for: replicas, hours, and the total
+# replicas x hours x stations bikes counts held as int16 histories
+MAX_REPLICAS = 10000
+MAX_HOURS = 24 * 7
+MAX_HISTORY_ELEMENTS = 100_000_000
+
+# Size of the long-lived pool shared by every request
+POOL_WORKERS = int(os.environ.get('BIKESIM_POOL_WORKERS', 0)) or os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Simulation each worker process runs its replicas on, unpickled once per run
+# and kept until a task from another run arrives
+_template_key = None
+_template = None
+# (distribution, time, weather) every replica starts from
+_initial_state = None
+
+
+def _shared_pool():
+    """Get the process pool shared by all runs, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS,
+                                        mp_context=multiprocessing.get_context(START_METHOD))
+        return _pool
+
+
+def _load_template(key, payload):
+    """Unpickle a run's template simulation in a worker unless it already holds it."""
+    global _template_key, _template, _initial_state
+    if key != _template_key:
+        _template = pickle.loads(payload)
+        _initial_state = (_template.current_distribution.copy(),
+                          _template.current_time,
+                          _template.current_weather)
+        _template_key = key
+    return _template
+
+
+def _run_chunk(key, payload, seed_sequences, hours, use_quantum, weathers, times):
+    """Run a chunk of replicas in a worker process and stack their histories."""
+    _load_template(key, payload)
+    return np.stack([_run_replica(seed_sequence, hours, use_quantum, weather, time)
+                     for seed_sequence, weather, time in zip(seed_sequences, weathers, times)])
+
+
+def _run_replica(seed_sequence, hours, use_quantum, weather=None, time=None):
+    """
+    Run one replica in a worker process, starting from the template state.
+    
+    Args:
+        seed_sequence: Independent numpy SeedSequence for this replica
+        hours: Number of hourly steps to simulate
+        use_quantum: Whether to use the quantum step instead of the classical one
+        weather: Optional weather override for this replica
+        time: Optional starting hour override for this replica
+    
+    Returns:
+        An int16 array of shape (hours, num_stations) with the bikes per
+        station after each step.
+    """
+    simulation = _template
+    distribution, start_time, start_weather = _initial_state
+    
+    # Reset the worker's simulation; cached transition matrices are reused
+    simulation.rng = np.random.default_rng(seed_sequence)
+    simulation.current_distribution = distribution.copy()
+    simulation.current_time = start_time if time is None else time % 24
+    simulation.current_weather = start_weather if weather is None else weather
+    simulation.apply_time_and_weather_factors()
+    
+    history = np.empty((hours, simulation.num_stations), dtype=np.int16)
+    for hour in range(hours):
+        if use_quantum:
+            simulation.run_quantum_step()
+        else:
+            simulation.run_classical_step()
+        
+        history[hour] = simulation.current_distribution
+        simulation.advance_time()
+    
+    return history
+
+
+def _run_tasks(simulation, seeds, hours, use_quantum, weathers, times, max_workers):
+    """Fan chunks of replica tasks out to a process pool and stack their histories."""
+    workers = max_workers or POOL_WORKERS
+    chunksize = max(1, len(seeds) // (workers * 4))
+    
+    # The template is pickled once per run; workers unpickle it once per run
+    payload = pickle.dumps(simulation)
+    key = os.urandom(16)
+    weathers, times = iter(weathers), iter(times)
+    chunks = [(seeds[start:start + chunksize],
+               list(islice(weathers, chunksize)),
+               list(islice(times, chunksize)))
+              for start in range(0, len(seeds), chunksize)]
+    
+    def run(pool):
+        futures = [pool.submit(_run_chunk, key, payload, chunk_seeds, hours, use_quantum,
+                               chunk_weathers, chunk_times)
+                   for chunk_seeds, chunk_weathers, chunk_times in chunks]
+        return np.concatenate([future.result() for future in futures])
+    
+    if max_workers is None:
+        return run(_shared_pool())
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+        return run(pool)
+
+
+def run_replicas(simulation, replicas, hours=24, use_quantum=True, seed=None, max_workers=None):
+    """
+    Run independent replicas of a simulation's current state in parallel processes.
+    
+    Every replica gets its own random stream spawned from a single seed, so a
+    run is reproducible regardless of how tasks land on workers.
+    
+    Args:
+        simulation: Initialized BikeRentalSimulation to copy replicas from
+        replicas: Number of independent replicas
+        hours: Number of hourly steps per replica
+        use_quantum: Whether to use the quantum step instead of the classical one
+        seed: Optional seed for the whole run
+        max_workers: Number of worker processes for a dedicated pool (defaults
+            to the long-lived shared pool of POOL_WORKERS processes)
+    
+    Returns:
+        An int16 array of shape (replicas, hours, num_stations).
+    """
+    seeds = np.random.SeedSequence(seed).spawn(replicas)
+    return _run_tasks(simulation, seeds, hours, use_quantum,
+                      repeat(None), repeat(None), max_workers)
+
+
+def run_scenarios(simulation, scenarios, hours=24, use_quantum=True, seed=None, max_workers=None):
+    """
+    Run one replica per scenario in parallel processes.
+    
+    Args:
+        simulation: Initialized BikeRentalSimulation to copy scenarios from
+        scenarios: List of dictionaries with optional 'weather' and 'time' overrides
+        hours: Number of hourly steps per scenario
+        use_quantum: Whether to use the quantum step instead of the classical one
+        seed: Optional seed for the whole run
+        max_workers: Number of worker processes for a dedicated pool (defaults
+            to the long-lived shared pool of POOL_WORKERS processes)
+    
+    Returns:
+        An int16 array of shape (len(scenarios), hours, num_stations).
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(scenarios))
+    return _run_tasks(simulation, seeds, hours, use_quantum,
+                      [scenario.get('weather') for scenario in scenarios],
+                      [scenario.get('time') for scenario in scenarios],
+                      max_workers)
+
+
+def simulate_day_ensemble(simulation, replicas=1000, hours=24, use_quantum=True,
+                          percentiles=(5, 50, 95), seed=None, max_workers=None):
+    """
+    Parallel counterpart of BikeRentalSimulation.simulate_day_ensemble.
+    
+    Returns:
+        A dictionary with the same shape as the in-process ensemble result.
+    """
+    histories = run_replicas(simulation, replicas, hours, use_quantum, seed, max_workers)
+    
+    results = [
+        summarize_ensemble_hour(histories[:, hour],
+                                (simulation.current_time + hour) % 24,
+                                simulation.current_weather,
+                                percentiles)
+        for hour in range(hours)
+    ]
+    return {
+        "replicas": replicas,
+        "hours": results
+    }
@@ -1,5 +1,13 @@
+import os
+import uuid
+from collections import deque
 import numpy as np
 import cirq
+import sympy
+from functools import lru_cache
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+from scipy.spatial import cKDTree
 import matplotlib.pyplot as plt
 from typing import List, Dict, Tuple
 import json
@@ -41,6 +49,55 @@ STATION_LOCATIONS = [
     {'neighborhood': 'Long Island City', 'address': 'Vernon Blvd & 50th Ave'},
 ]
 
+# Nearest stations kept per station for overflow redistribution; the KD-tree
+# is queried for the full ordering only when all of them are full
+NEIGHBOR_LIST_SIZE = 16
+
+# Source stations per block when building the transition matrix, which bounds
+# the pairwise distance intermediates to (block, num_stations) arrays
+TRANSITION_CHUNK_SIZE = 256
+
+# Memory budget for cached time/weather transition matrices; the oldest
+# entries are rebuilt on demand once it is exceeded
+TRANSITION_BANK_MAX_BYTES = 256 * 1024 ** 2
+
+# Weather conditions in the order used for compact integer weather codes
+WEATHER_CONDITIONS = ["sunny", "cloudy", "rainy", "snowy", "stormy"]
+
+# State versions remembered for delta updates; clients further behind get a full snapshot
+CHANGE_LOG_SIZE = 256
+
+# Forecasts at least this long on networks up to this size raise a cached
+# one-day propagation matrix to a power by repeated squaring; others step hour
+# by hour with matrix-vector products
+FORECAST_SQUARING_MIN_HOURS = 24 * 7
+FORECAST_SQUARING_MAX_STATIONS = 500
+
+# Longest forecasts: with repeated squaring the cost grows with log(hours),
+# stepping hour by hour it grows linearly, so larger networks get a shorter horizon
+FORECAST_MAX_HOURS = 24 * 365
+FORECAST_STEPPED_MAX_HOURS = 24 * 14
+
+# Memory budget for cached one-day propagation powers; the oldest are
+# recomputed on demand once it is exceeded
+FORECAST_CACHE_MAX_BYTES = 128 * 1024 ** 2
+
+# Networks up to this size get the stationary distribution from a dense
+# eigendecomposition; larger ones use a sparse eigensolver, falling back to
+# power iteration when it doesn't converge
+STATIONARY_DENSE_MAX_STATIONS = 1000
+STATIONARY_TOLERANCE = 1e-10
+STATIONARY_MAX_ITERATIONS = 20000
+
+# Networks up to this size get the quantum step's measurement statistics by
+# simulating the symbolic circuit for every source station; larger ones
+# evaluate the same single-qubit rotations in closed form
+QUANTUM_SWEEP_MAX_STATIONS = 1000
+
+# Upper bound on the move array (replicas x stations x destinations) drawn in
+# one ensemble step; larger ensembles are stepped in chunks of replicas
+ENSEMBLE_CHUNK_ELEMENTS = 4_000_000
+
 def assign_capacities(locations, densities):
     capacities = []
     for loc in locations:
@@ -51,35 +108,198 @@ def assign_capacities(locations, densities):
     return capacities
 
 
+def summarize_ensemble_hour(distributions, time, weather, percentiles=(5, 50, 95)):
+    """
+    Summarize one hour of an ensemble run.
+    
+    Args:
+        distributions: Bikes per station for every replica, shape (replicas, num_stations)
+        time: Hour of the day the step ran at
+        weather: Weather during the step
+        percentiles: Percentiles of bikes per station to report
+        
+    Returns:
+        A dictionary with per-station mean, percentiles and stock-out probability.
+    """
+    return {
+        "time": time,
+        "weather": weather,
+        "mean": distributions.mean(axis=0).tolist(),
+        "percentiles": {
+            str(q): values.tolist()
+            for q, values in zip(percentiles, np.percentile(distributions, percentiles, axis=0))
+        },
+        "stockout_probability": (distributions == 0).mean(axis=0).tolist()
+    }
+
+
+class HorizonResult:
+    """
+    Columnar hourly results of a long simulation run.
+    
+    Each column is a preallocated NumPy array with one row per simulated
+    hour, which keeps a year of hourly data for 1,000 stations around 17 MB.
+    
+    Attributes:
+        bikes: int16 bikes per station after each step, shape (hours, num_stations)
+        time: int8 hour of the day each step ran at
+        weather: int8 index into WEATHER_CONDITIONS of each step's weather
+        movement: int32 number of bikes that changed station in each step
+        capacities: int16 capacity of each station
+    """
+    
+    COLUMNS = ('bikes', 'time', 'weather', 'movement', 'capacities')
+    
+    def __init__(self, bikes, time, weather, movement, capacities):
+        self.bikes = bikes
+        self.time = time
+        self.weather = weather
+        self.movement = movement
+        self.capacities = capacities
+    
+    @classmethod
+    def allocate(cls, hours, num_stations, path=None):
+        """
+        Preallocate the columns for a run.
+        
+        Args:
+            hours: Number of hourly steps
+            num_stations: Number of stations
+            path: Optional directory to hold the columns as memory-mapped .npy files
+        """
+        shapes = {
+            'bikes': ((hours, num_stations), np.int16),
+            'time': ((hours,), np.int8),
+            'weather': ((hours,), np.int8),
+            'movement': ((hours,), np.int32),
+            'capacities': ((num_stations,), np.int16),
+        }
+        if path is None:
+            return cls(**{name: np.zeros(shape, dtype) for name, (shape, dtype) in shapes.items()})
+        
+        os.makedirs(path, exist_ok=True)
+        return cls(**{
+            name: np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+',
+                                            dtype=dtype, shape=shape)
+            for name, (shape, dtype) in shapes.items()
+        })
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Load results saved with save() or written to a memory-mapped directory.
+        
+        Args:
+            path: An .npz file, or a directory of .npy columns (opened memory-mapped)
+        """
+        if os.path.isdir(path):
+            return cls(**{name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                          for name in cls.COLUMNS})
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in cls.COLUMNS})
+    
+    def save(self, path):
+        """Save all columns to a compressed .npz file."""
+        np.savez_compressed(path, **{name: getattr(self, name) for name in self.COLUMNS})
+    
+    def flush(self):
+        """Write memory-mapped columns back to disk."""
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            if isinstance(column, np.memmap):
+                column.flush()
+    
+    @property
+    def nbytes(self):
+        """Total size of the columns in bytes."""
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
+
+
+@lru_cache(maxsize=None)
+def _destination_circuit_template(num_qubits):
+    """
+    Build the symbolic destination circuit shared by every source station.
+    
+    Rotations on the same qubit add up, so the per-destination ry gates of a
+    station's circuit collapse into a single ry(theta_j) on each qubit.
+    
+    Args:
+        num_qubits: Number of qubits encoding the destination station
+        
+    Returns:
+        A (circuit, symbols) tuple with one rotation symbol per qubit.
+    """
+    qubits = [cirq.GridQubit(0, i) for i in range(num_qubits)]
+    symbols = [sympy.Symbol(f'theta_{j}') for j in range(num_qubits)]
+    
+    circuit = cirq.Circuit()
+    circuit.append(cirq.H.on_each(*qubits))
+    circuit.append(cirq.ry(symbol).on(qubit) for qubit, symbol in zip(qubits, symbols))
+    circuit.append(cirq.measure(*qubits, key='result'))
+    return circuit, symbols
+
+
 class BikeRentalSimulation:
     """
     A quantum-enhanced Markov Chain simulation for bike rental systems.
     Uses Cirq for quantum operations to enhance the simulation capabilities.
     """
     
-    def __init__(self, num_stations: int, num_bikes: int):
+    def __init__(self, num_stations: int, num_bikes: int, seed=None, neighbors=None):
         """
         Initialize the bike rental simulation.
         
         Args:
             num_stations: Number of bike stations
             num_bikes: Total number of bikes in the system
+            seed: Optional seed for the simulation's random number generator
+            neighbors: If set, keep only this many nearest destinations per station
+                in a sparse CSR transition matrix instead of a dense one
         """
         self.num_stations = num_stations
         self.num_bikes = num_bikes
+        self.neighbors = neighbors
+        self.rng = np.random.default_rng(seed)
         self.transition_matrix = None
+        self.base_transition_matrix = None
         self.current_distribution = None
         self.station_capacities = None
         self.station_locations = None
+        # Source ids of stations loaded from an inventory (None for generated layouts);
+        # the API keeps numbering stations 1..num_stations in this order
+        self.station_ids = None
+        # Identifies the station network (locations, capacities) so clients can
+        # cache its static columns; changes whenever a new layout is set up
+        self.layout_id = None
+        # Bumped on every change to the distribution, time or weather, with the
+        # indices of the stations each version changed kept in _change_log
+        self.state_version = 0
+        self._change_log = deque(maxlen=CHANGE_LOG_SIZE)
+        # ((layout_id, state_version), JSON bytes) of the last exported snapshot
+        self._snapshot_cache = (None, None)
         self.time_of_day_factors = None
         self.weather_factors = None
         self.current_weather = "sunny"
         self.current_time = 8  # 8 AM
+        # Effective transition matrices keyed by their combined time/weather scale
+        self._transition_bank = {}
+        # Combined time/weather scale of the active matrix (None for the base matrix)
+        self._transition_scale = None
+        # Exact per-qubit measurement probabilities for quantum steps, one
+        # (num_stations, num_qubits) array per transition scale
+        self._destination_cache = {}
+        # Expected-value propagation matrices for forecasts, keyed by
+        # (start hour, weather, horizon in hours)
+        self._forecast_cache = {}
+        # Stationary distribution and mixing estimates keyed by (hour, weather)
+        self._stationary_cache = {}
         
     def initialize_system(self):
         """Initialize the system with default parameters."""
-        # Set station capacities (maximum number of bikes each station can hold)
-        self.station_capacities = assign_capacities(STATION_LOCATIONS, neighborhood_densities)
+        # Set station capacities (maximum number of bikes each station can hold),
+        # reusing the known locations' neighborhoods for larger networks
+        locations = [STATION_LOCATIONS[i % len(STATION_LOCATIONS)] for i in range(self.num_stations)]
+        self.station_capacities = assign_capacities(locations, neighborhood_densities)
         
         # Initialize station locations (x, y coordinates) with 1-based indexing
         # Creating a proper distribution across the map area for better visualization
@@ -106,8 +326,8 @@ class BikeRentalSimulation:
                 base_y = spacing + row * spacing
                 
                 # Add small random offset for natural look (but not too much)
-                x = base_x + np.random.uniform(-spacing/4, spacing/4)
-                y = base_y + np.random.uniform(-spacing/4, spacing/4)
+                x = base_x + self.rng.uniform(-spacing/4, spacing/4)
+                y = base_y + self.rng.uniform(-spacing/4, spacing/4)
                 
                 # Ensure within boundaries
                 x = max(0.5, min(9.5, x))
@@ -116,20 +336,87 @@ class BikeRentalSimulation:
                 # Store with 1-based index
                 self.station_locations[i + 1] = (x, y)
         
+        # Station coordinates as a (num_stations, 2) array, row i is station i+1
+        self.station_coords = np.array([self.station_locations[i + 1] for i in range(self.num_stations)], dtype=float)
+        self.station_ids = None
+        self.layout_id = uuid.uuid4().hex
+        self._build_station_index()
+        
         # Initialize bikes distribution across stations
+        self.current_distribution = self._distribute_bikes(self.station_capacities)
+        
+        self._set_demand_factors()
+        
+        # Create initial transition matrix based on distances
+        self._create_transition_matrix()
+        self.reset_state_version(self.state_version + 1)
+    
+    def load_inventory(self, inventory):
+        """
+        Initialize the system from a real station inventory.
+        
+        Args:
+            inventory: StationInventory, e.g. from stations.load_station_inventory()
+        """
+        self.num_stations = len(inventory)
+        capacities = np.asarray(inventory.capacities)
+        self.load_layout(inventory.coords(), capacities, self._distribute_bikes(capacities),
+                         station_ids=inventory.ids)
+    
+    def _distribute_bikes(self, capacities):
+        """
+        Spread the fleet randomly over the stations without exceeding any capacity.
+        
+        Args:
+            capacities: Capacity of every station
+            
+        Returns:
+            An int array with the bikes at every station.
+        """
         remaining_bikes = self.num_bikes
-        self.current_distribution = np.zeros(self.num_stations, dtype=int)
+        distribution = np.zeros(self.num_stations, dtype=int)
         
         for i in range(self.num_stations - 1):
-            max_bikes = min(remaining_bikes, self.station_capacities[i])
+            max_bikes = min(remaining_bikes, capacities[i])
             if max_bikes > 0:
-                bikes_at_station = np.random.randint(0, max_bikes + 1)
-                self.current_distribution[i] = bikes_at_station
+                bikes_at_station = self.rng.integers(0, max_bikes + 1)
+                distribution[i] = bikes_at_station
                 remaining_bikes -= bikes_at_station
         
         # Put remaining bikes in the last station
-        self.current_distribution[-1] = min(remaining_bikes, self.station_capacities[-1])
+        distribution[-1] = min(remaining_bikes, capacities[self.num_stations - 1])
+        return distribution
+    
+    def load_layout(self, station_coords, station_capacities, current_distribution,
+                    base_transition_matrix=None, station_ids=None):
+        """
+        Initialize the system from existing station arrays instead of generating a layout.
         
+        Args:
+            station_coords: Station (x, y) coordinates, shape (num_stations, 2)
+            station_capacities: Capacity of every station
+            current_distribution: Bikes at every station
+            base_transition_matrix: Optional precomputed distance-based transition
+                matrix; built from the coordinates when omitted
+            station_ids: Optional source ids of the stations, as strings
+        """
+        self.station_coords = np.asarray(station_coords, dtype=float)
+        self.station_ids = None if station_ids is None else np.array(station_ids, dtype=str)
+        self.station_locations = {i + 1: (x, y) for i, (x, y) in enumerate(self.station_coords.tolist())}
+        self.station_capacities = station_capacities
+        self.current_distribution = np.array(current_distribution, dtype=int)
+        self.layout_id = uuid.uuid4().hex
+        self._build_station_index()
+        self._set_demand_factors()
+        
+        if base_transition_matrix is None:
+            self._create_transition_matrix()
+        else:
+            self._set_base_transition_matrix(base_transition_matrix)
+        self.reset_state_version(self.state_version + 1)
+    
+    def _set_demand_factors(self):
+        """Set the time of day and weather demand factors."""
         # Time of day factors (how likely users are to rent/return bikes based on time)
         # 24 hours, with factors representing demand
         self.time_of_day_factors = {
@@ -147,107 +434,333 @@ class BikeRentalSimulation:
             "snowy": 0.3,
             "stormy": 0.2
         }
+    
+    def _build_station_index(self):
+        """Build the spatial index and nearest-neighbour lists used for overflow redistribution."""
+        self._station_tree = cKDTree(self.station_coords)
         
-        # Create initial transition matrix based on distances
-        self._create_transition_matrix()
+        # Each list starts with the closest stations (usually the station itself)
+        k = min(self.num_stations, NEIGHBOR_LIST_SIZE)
+        _, neighbors = self._station_tree.query(self.station_coords, k=k)
+        self._neighbor_lists = np.asarray(neighbors).reshape(self.num_stations, k)
     
     def _create_transition_matrix(self):
         """Create the Markov transition matrix based on station distances and other factors."""
-        # Initialize matrix
-        self.transition_matrix = np.zeros((self.num_stations, self.num_stations))
+        if self.neighbors is not None:
+            matrix = self._create_sparse_transition_matrix()
+        else:
+            matrix = np.empty((self.num_stations, self.num_stations))
+            for start in range(0, self.num_stations, TRANSITION_CHUNK_SIZE):
+                stop = min(start + TRANSITION_CHUNK_SIZE, self.num_stations)
+                self._fill_transition_rows(matrix[start:stop], start)
         
-        # Calculate distances between stations
-        distances = np.zeros((self.num_stations, self.num_stations))
+        self._set_base_transition_matrix(matrix)
+    
+    def _set_base_transition_matrix(self, matrix):
+        """Install a new base transition matrix and make it the active one."""
+        # Every row changes, so nothing derived from the old matrix survives
+        self._transition_bank.clear()
+        self._destination_cache.clear()
+        self._forecast_cache.clear()
+        self._stationary_cache.clear()
         
-        for i in range(self.num_stations):
-            for j in range(self.num_stations):
-                if i != j:
-                    # Euclidean distance
-                    x1, y1 = self.station_locations[i+1]  # 1-based indexing
-                    x2, y2 = self.station_locations[j+1]  # 1-based indexing
-                    distances[i, j] = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-        
-        # Convert distances to transition probabilities (closer = more likely)
-        for i in range(self.num_stations):
-            for j in range(self.num_stations):
-                if i != j:
-                    # Inverse of distance (farther stations are less likely)
-                    self.transition_matrix[i, j] = 1.0 / (distances[i, j] + 0.1)
-            
-            # Normalize each row to sum to 1
-            if np.sum(self.transition_matrix[i]) > 0:
-                self.transition_matrix[i] /= np.sum(self.transition_matrix[i])
+        # The base matrix is never modified; time and weather use scaled copies
+        self.base_transition_matrix = matrix
+        self.transition_matrix = matrix
+        self._transition_scale = None
+    
+    def _fill_transition_rows(self, rows, start):
+        """
+        Compute distance-based transition probabilities for a block of source stations.
+        
+        Args:
+            rows: Output block of shape (block_size, num_stations), filled in place
+                so that each row sums to 1
+            start: 0-based index of the first source station in the block
+        """
+        stop = start + len(rows)
+        x = self.station_coords[:, 0]
+        y = self.station_coords[:, 1]
+        
+        # Euclidean distance from each source in the block to every station
+        np.subtract(x[start:stop, None], x[None, :], out=rows)
+        rows *= rows
+        dy = y[start:stop, None] - y[None, :]
+        dy *= dy
+        rows += dy
+        np.sqrt(rows, out=rows)
+        
+        # Inverse of distance (farther stations are less likely); no self-transitions
+        rows += 0.1
+        np.reciprocal(rows, out=rows)
+        block = np.arange(stop - start)
+        rows[block, block + start] = 0
+        
+        # Normalize each row to sum to 1
+        row_sums = rows.sum(axis=1, keepdims=True)
+        np.divide(rows, row_sums, out=rows, where=row_sums > 0)
+    
+    def _create_sparse_transition_matrix(self):
+        """
+        Create a CSR transition matrix keeping only each station's nearest destinations.
+        
+        Every row stores exactly neighbors + 1 entries: the nearest destinations
+        plus the station itself, whose slot holds the probability of staying.
+        
+        Returns:
+            A scipy.sparse CSR matrix of shape (num_stations, num_stations).
+        """
+        stations = np.arange(self.num_stations)
+        width = min(self.neighbors + 1, self.num_stations)
+        distances, indices = self._station_tree.query(self.station_coords, k=width)
+        distances = np.asarray(distances, dtype=float).reshape(self.num_stations, width)
+        indices = np.asarray(indices).reshape(self.num_stations, width)
+        
+        # Co-located stations can push a station out of its own list; give it the last slot back
+        missing_self = ~(indices == stations[:, None]).any(axis=1)
+        indices[missing_self, -1] = stations[missing_self]
+        
+        # Inverse of distance (farther stations are less likely); no self-transitions
+        weights = 1.0 / (distances + 0.1)
+        weights[indices == stations[:, None]] = 0
+        
+        # Normalize each row to sum to 1
+        row_sums = weights.sum(axis=1, keepdims=True)
+        np.divide(weights, row_sums, out=weights, where=row_sums > 0)
+        
+        indptr = np.arange(0, self.num_stations * width + 1, width)
+        matrix = sparse.csr_matrix((weights.ravel(), indices.ravel(), indptr),
+                                   shape=(self.num_stations, self.num_stations))
+        matrix.sort_indices()
+        return matrix
+    
+    def _transition_row_entries(self, source_station):
+        """
+        Get the destinations and probabilities stored for a source station.
+        
+        Dense matrices return every station; sparse ones only the kept neighbours.
+        
+        Returns:
+            A (destinations, probabilities) tuple of arrays.
+        """
+        if sparse.issparse(self.transition_matrix):
+            start, stop = self.transition_matrix.indptr[source_station:source_station + 2]
+            return (self.transition_matrix.indices[start:stop],
+                    self.transition_matrix.data[start:stop])
+        return np.arange(self.num_stations), self.transition_matrix[source_station]
     
     def apply_time_and_weather_factors(self):
         """Apply time of day and weather factors to the transition matrix."""
-        time_factor = self.time_of_day_factors[self.current_time]
-        weather_factor = self.weather_factors[self.current_weather]
+        self.transition_matrix = self._effective_transition_matrix(self.current_time, self.current_weather)
+        self._transition_scale = self._factor_scale(self.current_time, self.current_weather)
+        self._bump_state_version()
+    
+    def _factor_scale(self, hour, weather):
+        """Combined time/weather scale applied to the off-diagonal transition probabilities."""
+        # At most every bike leaves, so the probability of staying never goes negative
+        return min(self.time_of_day_factors[hour] * self.weather_factors[weather], 1.0)
+    
+    def _effective_transition_matrix(self, hour, weather):
+        """
+        Get the transition matrix for an hour and weather condition.
         
-        # Scale the transition probabilities based on time and weather
-        # We don't modify the diagonal elements (probability of staying)
-        for i in range(self.num_stations):
-            for j in range(self.num_stations):
-                if i != j:
-                    self.transition_matrix[i, j] *= time_factor * weather_factor
+        The base matrix is scaled once per distinct time/weather factor and cached,
+        so combinations with the same factor share a matrix and repeated switches
+        are lookups.
+        
+        Args:
+            hour: Hour of the day (0-23)
+            weather: Weather condition key in weather_factors
             
-            # Recalculate probability of staying to ensure row sums to 1
-            self.transition_matrix[i, i] = 1 - sum(self.transition_matrix[i, j] for j in range(self.num_stations) if j != i)
+        Returns:
+            A dense or sparse matrix (matching the base) whose rows sum to 1.
+        """
+        # Scale the transition probabilities based on time and weather
+        scale = self._factor_scale(hour, weather)
+        matrix = self._transition_bank.get(scale)
+        if matrix is not None:
+            return matrix
+        
+        base = self.base_transition_matrix
+        if sparse.issparse(base):
+            # Rows have a fixed number of entries, so they can be scaled as a block
+            # and the index arrays can be shared with the base matrix
+            data = base.data.reshape(self.num_stations, -1) * scale
+            indices = base.indices.reshape(self.num_stations, -1)
+            is_self = indices == np.arange(self.num_stations)[:, None]
+            data[is_self] = 0
+            data[is_self] = np.maximum(1 - data.sum(axis=1), 0)
+            matrix = sparse.csr_matrix((data.ravel(), base.indices, base.indptr), shape=base.shape)
+            size = matrix.data.nbytes
+        else:
+            # Recalculate probability of staying to ensure each row sums to 1
+            matrix = base * scale
+            np.fill_diagonal(matrix, 0)
+            np.fill_diagonal(matrix, np.maximum(1 - matrix.sum(axis=1), 0))
+            size = matrix.nbytes
+        
+        # Evict the oldest cached matrices once over the memory budget
+        bank_size = size + sum(self._matrix_nbytes(m) for m in self._transition_bank.values())
+        for old_scale in list(self._transition_bank):
+            if bank_size <= TRANSITION_BANK_MAX_BYTES:
+                break
+            bank_size -= self._matrix_nbytes(self._transition_bank.pop(old_scale))
+            self._destination_cache.pop(old_scale, None)
+        
+        self._transition_bank[scale] = matrix
+        return matrix
+    
+    @staticmethod
+    def _matrix_nbytes(matrix):
+        """Bytes owned by a cached transition matrix (sparse ones share their indices)."""
+        return matrix.data.nbytes if sparse.issparse(matrix) else matrix.nbytes
     
     def run_classical_step(self):
         """Run one step of the classical Markov chain simulation."""
-        # Calculate how many bikes will move from each station
-        moves = np.zeros((self.num_stations, self.num_stations), dtype=int)
+        self._set_distribution(self._classical_transition(self.current_distribution[None, :])[0])
+        return self.current_distribution
+    
+    def _set_distribution(self, new_distribution):
+        """Replace the bike distribution after a step, recording which stations changed."""
+        changed = np.flatnonzero(new_distribution != self.current_distribution)
+        self.current_distribution = new_distribution
+        self._bump_state_version(changed)
+    
+    def _bump_state_version(self, changed_stations=()):
+        """Start a new state version, remembering the 0-based indices of changed stations."""
+        self.state_version += 1
+        self._change_log.append((self.state_version, np.asarray(changed_stations, dtype=np.intp)))
+    
+    def changes_since(self, version):
+        """
+        Get the stations whose bike count changed after a given state version.
         
-        for i in range(self.num_stations):
-            available_bikes = self.current_distribution[i]
-            if available_bikes > 0:
-                # Determine how many bikes will leave this station
-                departing_bikes = np.random.binomial(available_bikes, 
-                                                    self.time_of_day_factors[self.current_time] * 
-                                                    self.weather_factors[self.current_weather] * 0.3)
-                
-                if departing_bikes > 0:
-                    # Distribute departing bikes according to transition probabilities
-                    destination_probs = self.transition_matrix[i]
-                    destinations = np.random.choice(self.num_stations, 
-                                                  size=departing_bikes, 
-                                                  p=destination_probs)
-                    
-                    # Count moves to each destination
-                    for dest in destinations:
-                        moves[i, dest] += 1
+        Args:
+            version: state_version the client last saw
+            
+        Returns:
+            A sorted array of 0-based station indices, or None if the version
+            is unknown or too old for the change log (send a full snapshot).
+        """
+        if version == self.state_version:
+            return np.empty(0, dtype=np.intp)
+        if version > self.state_version or not self._change_log or version < self._change_log[0][0] - 1:
+            return None
         
-        # Apply the moves
-        new_distribution = self.current_distribution.copy()
+        changed = [stations for entry_version, stations in self._change_log if entry_version > version]
+        return np.unique(np.concatenate(changed))
+    
+    def reset_state_version(self, version):
+        """Adopt a state version published elsewhere, forgetting the local change log."""
+        self.state_version = version
+        self._change_log.clear()
+    
+    def _classical_transition(self, distributions, hour=None, weather=None):
+        """
+        Apply one classical Markov step to a batch of independent bike distributions.
         
-        for i in range(self.num_stations):
-            # Subtract departing bikes
-            departing = sum(moves[i, :])
-            new_distribution[i] -= departing
-            
-            # Add arriving bikes, limited by station capacity
-            for j in range(self.num_stations):
-                arriving = moves[j, i]
-                # Limit by remaining capacity
-                actual_arriving = min(arriving, self.station_capacities[i] - new_distribution[i])
-                new_distribution[i] += actual_arriving
-                
-                # If there's overflow (station full), redistribute
-                overflow = arriving - actual_arriving
-                if overflow > 0:
-                    # Find nearest stations with capacity
-                    for k in np.argsort([self._distance(i, s) for s in range(self.num_stations)]):
-                        if k != i and new_distribution[k] < self.station_capacities[k]:
-                            space_available = self.station_capacities[k] - new_distribution[k]
-                            bikes_to_add = min(overflow, space_available)
-                            new_distribution[k] += bikes_to_add
-                            overflow -= bikes_to_add
-                            
-                            if overflow == 0:
-                                break
+        Args:
+            distributions: Bikes per station, shape (replicas, num_stations)
+            hour: Hour of the day the step runs at (defaults to the current time)
+            weather: Weather during the step (defaults to the current weather)
+            
+        Returns:
+            The new distributions, same shape.
+        """
+        capacities = np.asarray(self.station_capacities[:self.num_stations])
+        if hour is None and weather is None:
+            hour, weather, matrix = self.current_time, self.current_weather, self.transition_matrix
+        else:
+            hour = self.current_time if hour is None else hour
+            weather = self.current_weather if weather is None else weather
+            matrix = self._effective_transition_matrix(hour, weather)
         
-        self.current_distribution = new_distribution
-        return self.current_distribution
+        # Determine how many bikes will leave every station at once
+        departing_bikes = self.rng.binomial(distributions,
+                                            self.time_of_day_factors[hour] * 
+                                            self.weather_factors[weather] * 0.3)
+        
+        # Distribute departing bikes according to transition probabilities
+        arriving = self._draw_arrivals(departing_bikes, matrix)
+        
+        # Apply the moves: subtract departures, then add arrivals limited by capacity
+        new_distributions = distributions - departing_bikes
+        actual_arriving = np.minimum(arriving, np.maximum(capacities - new_distributions, 0))
+        new_distributions += actual_arriving
+        
+        # If there's overflow (station full), redistribute
+        overflow = arriving - actual_arriving
+        for station in np.flatnonzero(overflow.any(axis=0)):
+            self._redistribute_overflow(new_distributions, station, overflow[:, station], capacities)
+        
+        return new_distributions
+    
+    def _draw_arrivals(self, departing_bikes, matrix):
+        """
+        Send departing bikes to destinations drawn from a transition matrix.
+        
+        Args:
+            departing_bikes: Bikes leaving each station, shape (replicas, num_stations)
+            matrix: Dense or sparse transition matrix to draw destinations from
+            
+        Returns:
+            The number of bikes arriving at each station, same shape.
+        """
+        replicas = len(departing_bikes)
+        
+        if sparse.issparse(matrix):
+            # moves[r, i, n] counts bikes travelling to station i's n-th kept neighbour
+            probabilities = matrix.data.reshape(self.num_stations, -1)
+            moves = self.rng.multinomial(departing_bikes, probabilities)
+            
+            # Offset each replica's destinations so one bincount covers the batch
+            offsets = np.arange(replicas)[:, None] * self.num_stations
+            destinations = matrix.indices[None, :] + offsets
+            arrivals = np.bincount(destinations.ravel(), weights=moves.ravel(),
+                                   minlength=replicas * self.num_stations)
+            return arrivals.reshape(replicas, self.num_stations).astype(int)
+        
+        # moves[r, i, j] counts bikes travelling from station i to station j
+        moves = self.rng.multinomial(departing_bikes, matrix)
+        return moves.sum(axis=1)
+    
+    def _redistribute_overflow(self, distributions, station, overflow, capacities):
+        """
+        Move bikes that could not dock at a full station to its nearest stations with space.
+        
+        Args:
+            distributions: Bikes per station for each replica, updated in place
+            station: 0-based index of the full station
+            overflow: Number of bikes that could not dock in each replica
+            capacities: Capacity of every station
+        """
+        overflow = overflow.copy()
+        
+        # Find nearest stations with capacity
+        for k in self._stations_by_distance(station):
+            if k == station:
+                continue
+            
+            bikes_to_add = np.minimum(overflow, np.maximum(capacities[k] - distributions[:, k], 0))
+            distributions[:, k] += bikes_to_add
+            overflow -= bikes_to_add
+            
+            if not overflow.any():
+                break
+    
+    def _stations_by_distance(self, station):
+        """
+        Yield station indices ordered by distance from a station, nearest first.
+        
+        The precomputed neighbour list is used first; the KD-tree is only
+        queried for the full ordering if the caller needs more stations.
+        """
+        neighbors = self._neighbor_lists[station]
+        yield from neighbors
+        
+        if len(neighbors) < self.num_stations:
+            _, order = self._station_tree.query(self.station_coords[station], k=self.num_stations)
+            yield from order[len(neighbors):]
     
     def _distance(self, station1, station2):
         """Calculate distance between two stations."""
@@ -256,17 +769,117 @@ class BikeRentalSimulation:
         x2, y2 = self.station_locations[station2+1]
         return np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
     
-    def run_quantum_step(self):
+    def _build_destination_circuit(self, source_station, qubits, measure=True):
+        """
+        Build the quantum random walk circuit for bikes leaving a station.
+        
+        Args:
+            source_station: 0-based index of the station bikes depart from
+            qubits: Qubits encoding the destination station in binary
+            measure: Whether to append the final measurement
+            
+        Returns:
+            A circuit whose 'result' key (when measured) encodes the destination.
+        """
+        num_qubits = len(qubits)
+        circuit = cirq.Circuit()
+        
+        # Start with superposition
+        circuit.append(cirq.H.on_each(*qubits))
+        
+        # Apply station preference operations
+        # More popular destinations get rotation gates to increase probability
+        destinations, probabilities = self._transition_row_entries(source_station)
+        for i, probability in zip(destinations, probabilities):
+            if i == source_station:
+                continue
+                
+            # Convert transition probability to rotation angle
+            angle = probability * np.pi
+            
+            # Get binary representation of destination
+            bin_dest = format(i, f'0{num_qubits}b')
+            
+            # Apply controlled rotations based on binary representation
+            for j, bit in enumerate(bin_dest):
+                if bit == '1':
+                    circuit.append(cirq.ry(angle).on(qubits[j]))
+        
+        # Measure
+        if measure:
+            circuit.append(cirq.measure(*qubits, key='result'))
+        return circuit
+    
+    def _destination_qubit_probabilities(self):
+        """
+        Get the exact measurement statistics of every source station's circuit.
+        
+        A station's circuit leaves its qubits unentangled, so its outcome
+        distribution is fixed by the probability of each qubit reading 1. The
+        first time a time/weather scale is used, the collapsed symbolic circuit
+        is simulated for all source stations in one parameter sweep and these
+        marginals are cached alongside the scale's transition matrix. Networks
+        above QUANTUM_SWEEP_MAX_STATIONS skip the simulator: each qubit goes
+        through H and ry(theta), so it reads 1 with probability (1 + sin(theta)) / 2.
+        
+        Returns:
+            An array of shape (num_stations, num_qubits) whose entry [i, j] is
+            the probability that qubit j (most significant first) measures 1
+            for bikes leaving station i.
+        """
+        cached = self._destination_cache.get(self._transition_scale)
+        if cached is not None:
+            return cached
+        
+        angles = self._rotation_angles()
+        if self.num_stations > QUANTUM_SWEEP_MAX_STATIONS:
+            probabilities = (1 + np.sin(angles)) / 2
+            self._destination_cache[self._transition_scale] = probabilities
+            return probabilities
+        
+        num_qubits = angles.shape[1]
+        circuit, symbols = _destination_circuit_template(num_qubits)
+        qubits = [cirq.GridQubit(0, i) for i in range(num_qubits)]
+        resolvers = [cirq.ParamResolver(dict(zip(symbols, source_angles))) for source_angles in angles]
+        
+        # Exact state vector simulation consumes no randomness
+        probabilities = np.empty((self.num_stations, num_qubits))
+        results = cirq.Simulator().simulate_sweep_iter(circuit[:-1], params=resolvers, qubit_order=qubits)
+        for source_station, result in enumerate(results):
+            outcome_probs = np.abs(result.final_state_vector.reshape((2,) * num_qubits)) ** 2
+            for j in range(num_qubits):
+                probabilities[source_station, j] = outcome_probs.take(1, axis=j).sum()
+        
+        self._destination_cache[self._transition_scale] = probabilities
+        return probabilities
+    
+    def run_quantum_step(self, method="analytic"):
         """
         Run a quantum-enhanced simulation step using Cirq.
         This uses quantum random walks to model bike movement patterns.
+        
+        Args:
+            method: 'analytic' draws departures from each source station's cached
+                exact measurement distribution; 'sweep' evaluates every source
+                station in one run_sweep call over a shared symbolic circuit;
+                'sampled' builds one circuit per source station and draws all of
+                its departing bikes from a single batched run, using a single
+                simulator for the whole step.
         """
+        if method == "analytic":
+            return self._run_analytic_quantum_step()
+        if method == "sweep":
+            return self._run_sweep_quantum_step()
+        
         # Number of qubits needed to represent all stations
         num_qubits = int(np.ceil(np.log2(self.num_stations)))
         
         # Create qubits
         qubits = [cirq.GridQubit(0, i) for i in range(num_qubits)]
         
+        # One simulator is shared by every circuit in this step
+        simulator = self._quantum_simulator()
+        
         # Track new distribution
         new_distribution = self.current_distribution.copy()
         
@@ -276,7 +889,7 @@ class BikeRentalSimulation:
                 continue
                 
             # Determine how many bikes may leave based on time and weather
-            potential_departures = np.random.binomial(
+            potential_departures = self.rng.binomial(
                 self.current_distribution[source_station],
                 self.time_of_day_factors[self.current_time] * 
                 self.weather_factors[self.current_weather] * 0.3
@@ -284,49 +897,124 @@ class BikeRentalSimulation:
             
             if potential_departures == 0:
                 continue
-                
-            # For each potentially departing bike, use quantum circuit
-            for _ in range(potential_departures):
-                # Create quantum circuit
-                circuit = cirq.Circuit()
-                
-                # Start with superposition
-                circuit.append(cirq.H.on_each(*qubits))
-                
-                # Apply station preference operations
-                # More popular destinations get rotation gates to increase probability
-                for i in range(self.num_stations):
-                    if i == source_station:
-                        continue
-                        
-                    # Convert transition probability to rotation angle
-                    angle = self.transition_matrix[source_station, i] * np.pi
-                    
-                    # Get binary representation of destination
-                    bin_dest = format(i, f'0{num_qubits}b')
-                    
-                    # Apply controlled rotations based on binary representation
-                    for j, bit in enumerate(bin_dest):
-                        if bit == '1':
-                            circuit.append(cirq.ry(angle).on(qubits[j]))
-                
-                # Measure
-                circuit.append(cirq.measure(*qubits, key='result'))
-                
-                # Simulate
-                simulator = cirq.Simulator()
-                result = simulator.run(circuit, repetitions=1)
-                
-                # Get measurement result
-                measurement = result.measurements['result'][0]
-                destination = int(''.join(str(bit) for bit in measurement), 2) % self.num_stations
-                
+            
+            # Draw every departing bike's destination from one batched run
+            circuit = self._build_destination_circuit(source_station, qubits)
+            result = simulator.run(circuit, repetitions=potential_departures)
+            
+            # Decode each repetition's bitstring into a station index
+            measurements = result.measurements['result']
+            powers = 1 << np.arange(num_qubits - 1, -1, -1)
+            destinations = (measurements @ powers) % self.num_stations
+            
+            for destination in destinations:
                 # If destination is valid and not the same as source, move a bike
                 if destination != source_station and new_distribution[destination] < self.station_capacities[destination]:
                     new_distribution[source_station] -= 1
                     new_distribution[destination] += 1
         
-        self.current_distribution = new_distribution
+        self._set_distribution(new_distribution)
+        return self.current_distribution
+    
+    def _run_analytic_quantum_step(self):
+        """Run a quantum step by sampling the cached exact measurement statistics."""
+        capacities = np.asarray(self.station_capacities[:self.num_stations])
+        new_distribution = self.current_distribution.copy()
+        qubit_probabilities = self._destination_qubit_probabilities()
+        powers = 1 << np.arange(qubit_probabilities.shape[1] - 1, -1, -1)
+        
+        # Determine how many bikes may leave each station based on time and weather
+        departures = self.rng.binomial(
+            self.current_distribution,
+            self.time_of_day_factors[self.current_time] * 
+            self.weather_factors[self.current_weather] * 0.3
+        )
+        
+        sources = np.flatnonzero(departures)
+        
+        # Measure every departing bike's qubits at once and decode its destination
+        bike_sources = np.repeat(sources, departures[sources])
+        bits = self.rng.random((len(bike_sources), len(powers))) < qubit_probabilities[bike_sources]
+        bike_destinations = (bits @ powers) % self.num_stations
+        
+        # Count bikes per (source, destination) pair, grouped by source
+        pairs, pair_counts = np.unique(bike_sources * self.num_stations + bike_destinations, return_counts=True)
+        pair_sources, pair_destinations = np.divmod(pairs, self.num_stations)
+        pair_counts[pair_sources == pair_destinations] = 0
+        bounds = np.searchsorted(pair_sources, sources, side='right')
+        
+        for source_station, start, stop in zip(sources, np.r_[0, bounds[:-1]], bounds):
+            destinations, arrivals = pair_destinations[start:stop], pair_counts[start:stop]
+            
+            # Bikes only move while the destination still has a free dock
+            moved = np.minimum(arrivals, np.maximum(capacities[destinations] - new_distribution[destinations], 0))
+            new_distribution[destinations] += moved
+            new_distribution[source_station] -= moved.sum()
+        
+        self._set_distribution(new_distribution)
+        return self.current_distribution
+    
+    def _quantum_simulator(self):
+        """Create a Cirq simulator seeded from the simulation's random number generator."""
+        return cirq.Simulator(seed=int(self.rng.integers(2 ** 32)))
+    
+    def _rotation_angles(self):
+        """
+        Get the summed ry angle on each qubit for every source station.
+        
+        Returns:
+            An array of shape (num_stations, num_qubits).
+        """
+        num_qubits = int(np.ceil(np.log2(self.num_stations)))
+        
+        # bits[i, j] is 1 when qubit j is set in destination i's binary code
+        shifts = np.arange(num_qubits - 1, -1, -1)
+        bits = (np.arange(self.num_stations)[:, None] >> shifts) & 1
+        
+        # A station never rotates towards itself, so its own bits are taken back out
+        angles = self.transition_matrix @ bits - self.transition_matrix.diagonal()[:, None] * bits
+        return np.asarray(angles) * np.pi
+    
+    def _run_sweep_quantum_step(self):
+        """Run a quantum step evaluating all source stations in a single parameter sweep."""
+        num_qubits = int(np.ceil(np.log2(self.num_stations)))
+        circuit, symbols = _destination_circuit_template(num_qubits)
+        capacities = np.asarray(self.station_capacities[:self.num_stations])
+        new_distribution = self.current_distribution.copy()
+        
+        # Determine how many bikes may leave each station based on time and weather
+        departures = self.rng.binomial(
+            self.current_distribution,
+            self.time_of_day_factors[self.current_time] * 
+            self.weather_factors[self.current_weather] * 0.3
+        )
+        sources = np.flatnonzero(departures)
+        if len(sources) == 0:
+            return self.current_distribution
+        
+        angles = self._rotation_angles()
+        resolvers = [
+            cirq.ParamResolver({symbol: angle for symbol, angle in zip(symbols, angles[source])})
+            for source in sources
+        ]
+        
+        # Every source shares the repetition count; each keeps only what it needs
+        results = self._quantum_simulator().run_sweep(circuit, params=resolvers,
+                                             repetitions=int(departures[sources].max()))
+        powers = 1 << np.arange(num_qubits - 1, -1, -1)
+        
+        for source_station, result in zip(sources, results):
+            measurements = result.measurements['result'][:departures[source_station]]
+            destinations = (measurements @ powers) % self.num_stations
+            arrivals = np.bincount(destinations, minlength=self.num_stations)
+            arrivals[source_station] = 0
+            
+            # Bikes only move while the destination still has a free dock
+            moved = np.minimum(arrivals, np.maximum(capacities - new_distribution, 0))
+            new_distribution += moved
+            new_distribution[source_station] -= moved.sum()
+        
+        self._set_distribution(new_distribution)
         return self.current_distribution
     
     def advance_time(self, hours=1):
@@ -345,7 +1033,7 @@ class BikeRentalSimulation:
     
     def get_station_info(self):
         """Get information about all stations for visualization."""
-        return {
+        info = {
             "stations": [
                 {
                     "id": i+1,  # 1-based indexing
@@ -359,6 +1047,12 @@ class BikeRentalSimulation:
             "weather": self.current_weather,
             "total_bikes": int(np.sum(self.current_distribution))
         }
+        
+        # Stations loaded from an inventory also carry their source id
+        if self.station_ids is not None:
+            for station, station_id in zip(info["stations"], self.station_ids.tolist()):
+                station["station_id"] = station_id
+        return info
     
     def visualize_system(self, ax=None, show_flows=True):
         """Visualize the bike stations on a map with optional flow indicators."""
@@ -475,11 +1169,407 @@ class BikeRentalSimulation:
         
         # Reset time to original
         self.current_time = original_time
+        self.apply_time_and_weather_factors()
         return results
     
+    def iter_hours(self, hours=24, use_quantum=True):
+        """
+        Step the simulation hour by hour, yielding each hour's state as soon as it is ready.
+        
+        The final distribution is kept, while the clock stays at its starting hour.
+        
+        Args:
+            hours: Number of hourly steps to simulate
+            use_quantum: Whether to use the quantum step instead of the classical one
+        
+        Yields:
+            simulate_hour() for each hour.
+        """
+        for offset in range(hours):
+            yield self.simulate_hour(offset, use_quantum)
+    
+    def simulate_hour(self, offset=0, use_quantum=True):
+        """
+        Run one step as the given hour of a run starting at the current time.
+        
+        The clock is moved ahead for the step only and then put back, so each
+        hour of a long run can be stepped separately (e.g. releasing the
+        session's lock in between).
+        
+        Args:
+            offset: Hours after the current time the step runs at
+            use_quantum: Whether to use the quantum step instead of the classical one
+        
+        Returns:
+            get_station_info() at that hour, plus 'movement' (bikes that
+            changed station) and 'activity_factor' (expected activity level).
+        """
+        original_time = self.current_time
+        if offset % 24:
+            self.current_time = (original_time + offset) % 24
+            self.apply_time_and_weather_factors()
+        
+        try:
+            previous_distribution = self.current_distribution.copy()
+            
+            if use_quantum:
+                self.run_quantum_step()
+            else:
+                self.run_classical_step()
+            
+            result = self.get_station_info()
+            
+            # Each bike counts twice (once leaving, once arriving)
+            result['movement'] = int(np.abs(self.current_distribution - previous_distribution).sum()) // 2
+            result['activity_factor'] = self.time_of_day_factors[self.current_time] * 20
+            return result
+        finally:
+            if self.current_time != original_time:
+                self.current_time = original_time
+                self.apply_time_and_weather_factors()
+    
+    def simulate_horizon(self, hours, use_quantum=True, path=None):
+        """
+        Simulate many hours into compact columnar arrays instead of per-hour dicts.
+        
+        Like simulate_day, the final distribution is kept and the clock is
+        reset to its starting hour afterwards.
+        
+        Args:
+            hours: Number of hourly steps to simulate, e.g. 24 * 365 for a year
+            use_quantum: Whether to use the quantum step instead of the classical one
+            path: Optional directory to write the columns to as memory-mapped .npy files
+            
+        Returns:
+            A HorizonResult with one row per hour.
+        """
+        result = HorizonResult.allocate(hours, self.num_stations, path)
+        result.capacities[:] = self.station_capacities[:self.num_stations]
+        weather = WEATHER_CONDITIONS.index(self.current_weather)
+        original_time = self.current_time
+        
+        try:
+            for hour in range(hours):
+                previous_distribution = self.current_distribution.copy()
+                
+                if use_quantum:
+                    self.run_quantum_step()
+                else:
+                    self.run_classical_step()
+                
+                result.bikes[hour] = self.current_distribution
+                result.time[hour] = self.current_time
+                result.weather[hour] = weather
+                # Each bike counts twice (once leaving, once arriving)
+                result.movement[hour] = np.abs(self.current_distribution - previous_distribution).sum() // 2
+                self.advance_time()
+        finally:
+            self.current_time = original_time
+            self.apply_time_and_weather_factors()
+        
+        result.flush()
+        return result
+    
+    def simulate_day_ensemble(self, replicas=1000, hours=24, percentiles=(5, 50, 95)):
+        """
+        Simulate many independent classical replicas of the current state at once.
+        
+        The replicas advance together as a (replicas, num_stations) array,
+        stepped with each hour's effective transition matrix; the simulation's
+        own distribution, clock and state version are left untouched.
+        
+        Args:
+            replicas: Number of independent replicas
+            hours: Number of hourly steps to simulate
+            percentiles: Percentiles of bikes per station to report
+            
+        Returns:
+            A dictionary with per-hour, per-station mean, percentiles and
+            stock-out probability across the replicas.
+        """
+        # Bound the per-step move array (replicas x stations x destinations)
+        destinations = (self.transition_matrix.data.size // self.num_stations
+                        if sparse.issparse(self.transition_matrix) else self.num_stations)
+        chunk_size = max(1, ENSEMBLE_CHUNK_ELEMENTS // (self.num_stations * destinations))
+        
+        distributions = np.repeat(self.current_distribution[None, :], replicas, axis=0)
+        results = []
+        
+        for offset in range(hours):
+            hour = (self.current_time + offset) % 24
+            for start in range(0, replicas, chunk_size):
+                chunk = slice(start, start + chunk_size)
+                distributions[chunk] = self._classical_transition(distributions[chunk], hour,
+                                                                  self.current_weather)
+            
+            results.append(summarize_ensemble_hour(distributions, hour, self.current_weather, percentiles))
+        
+        return {
+            "replicas": replicas,
+            "hours": results
+        }
+    
+    def forecast(self, hours=6):
+        """
+        Forecast the expected bike distribution a number of hours ahead, without sampling.
+        
+        Each hour a fraction of every station's bikes departs and is spread by
+        that hour's effective transition matrix, so the expected distribution
+        evolves linearly. Short horizons apply this hour by hour as
+        matrix-vector products; long ones on small networks use cached powers
+        of the one-day propagation matrix. Capacity limits are not applied,
+        which is what exposes where expected demand exceeds a station's docks.
+        
+        Args:
+            hours: Number of hours ahead, at most max_forecast_hours()
+            
+        Returns:
+            A dictionary with the expected bikes per station after the given
+            number of hours and the stations expected to exceed their capacity.
+        """
+        expected = self.current_distribution.astype(float)
+        hour = self.current_time
+        
+        if hours >= FORECAST_SQUARING_MIN_HOURS and self.num_stations <= FORECAST_SQUARING_MAX_STATIONS:
+            expected = expected @ self._day_propagation_power(hour, self.current_weather, hours // 24)
+            remaining = hours % 24
+        else:
+            remaining = hours
+        
+        for _ in range(remaining):
+            expected = self._expected_step(expected, hour, self.current_weather)
+            hour = (hour + 1) % 24
+        
+        capacities = np.asarray(self.station_capacities[:self.num_stations])
+        over_capacity = np.flatnonzero(expected > capacities)
+        return {
+            "start_time": self.current_time,
+            "time": (self.current_time + hours) % 24,
+            "hours": hours,
+            "weather": self.current_weather,
+            "expected": expected.tolist(),
+            "total_bikes": float(expected.sum()),
+            "over_capacity": [
+                {"id": int(i) + 1, "expected": float(expected[i]), "capacity": int(capacities[i])}
+                for i in over_capacity
+            ]
+        }
+    
+    def max_forecast_hours(self):
+        """Longest horizon forecast() serves for this network's size."""
+        if self.num_stations <= FORECAST_SQUARING_MAX_STATIONS:
+            return FORECAST_MAX_HOURS
+        return FORECAST_STEPPED_MAX_HOURS
+    
+    def _expected_step(self, expected, hour, weather):
+        """
+        Propagate expected bikes per station through one hour.
+        
+        Args:
+            expected: Expected bikes per station, shape (num_stations,) or
+                (num_stations, k) for k distributions at once
+            hour: Hour of the day the step runs at
+            weather: Weather condition during the step
+        """
+        departure_probability = self.time_of_day_factors[hour] * self.weather_factors[weather] * 0.3
+        moved = self._effective_transition_matrix(hour, weather).T @ expected
+        return expected + departure_probability * (moved - expected)
+    
+    def _hour_propagation_matrix(self, hour, weather):
+        """Dense matrix M with expected_next = expected @ M for one hour."""
+        departure_probability = self.time_of_day_factors[hour] * self.weather_factors[weather] * 0.3
+        matrix = self._effective_transition_matrix(hour, weather)
+        matrix = matrix.toarray() if sparse.issparse(matrix) else matrix
+        propagation = departure_probability * matrix
+        propagation[np.diag_indices(self.num_stations)] += 1 - departure_probability
+        return propagation
+    
+    def _day_propagation_power(self, start_hour, weather, days):
+        """
+        Propagation matrix for a whole number of days from an hour, by repeated squaring.
+        
+        Products for horizons of 24 * 2**k hours are cached by
+        (start hour, weather, horizon) within FORECAST_CACHE_MAX_BYTES and
+        reused across forecasts.
+        """
+        power = self._forecast_cache.get((start_hour, weather, 24))
+        if power is None:
+            power = np.eye(self.num_stations)
+            for offset in range(24):
+                power = power @ self._hour_propagation_matrix((start_hour + offset) % 24, weather)
+            self._cache_forecast_power((start_hour, weather, 24), power)
+        
+        result = np.eye(self.num_stations)
+        horizon = 24
+        while days:
+            if days & 1:
+                result = result @ power
+            days >>= 1
+            if days:
+                horizon *= 2
+                key = (start_hour, weather, horizon)
+                squared = self._forecast_cache.get(key)
+                if squared is None:
+                    squared = power @ power
+                    self._cache_forecast_power(key, squared)
+                power = squared
+        return result
+    
+    def _cache_forecast_power(self, key, matrix):
+        """Cache a propagation power, evicting the oldest ones over the memory budget."""
+        cache_size = matrix.nbytes + sum(m.nbytes for m in self._forecast_cache.values())
+        for old_key in list(self._forecast_cache):
+            if cache_size <= FORECAST_CACHE_MAX_BYTES:
+                break
+            cache_size -= self._forecast_cache.pop(old_key).nbytes
+        
+        if cache_size <= FORECAST_CACHE_MAX_BYTES:
+            self._forecast_cache[key] = matrix
+    
+    def stationary_distribution(self, hour=None, weather=None, epsilon=0.25):
+        """
+        Compute the long-run distribution of bikes and how quickly it is reached.
+        
+        The hourly chain leaves every bike where it is with probability 1 - p
+        and otherwise moves it by the effective transition matrix, so its
+        stationary distribution pi solves pi M = pi for
+        M = (1 - p) I + p P. The gap between 1 and the second largest
+        eigenvalue modulus of M bounds how fast any initial imbalance decays.
+        
+        Args:
+            hour: Hour of the day whose matrix to use (defaults to the current hour)
+            weather: Weather condition (defaults to the current weather)
+            epsilon: Total variation distance the mixing time is estimated for
+            
+        Returns:
+            A dictionary with the stationary fraction and expected bikes per
+            station, the second eigenvalue modulus, the spectral gap, and the
+            relaxation and mixing times in hours.
+        """
+        hour = self.current_time if hour is None else hour % 24
+        weather = self.current_weather if weather is None else weather
+        
+        key = (hour, weather)
+        if key not in self._stationary_cache:
+            self._stationary_cache[key] = self._solve_stationary(self._hourly_chain_matrix(hour, weather))
+        stationary, second_eigenvalue = self._stationary_cache[key]
+        
+        gap = 1.0 - second_eigenvalue
+        relaxation_time = 1.0 / gap if gap > 0 else float('inf')
+        # Standard bound t_mix(eps) <= t_rel * ln(1 / (eps * pi_min))
+        pi_min = max(stationary.min(), np.finfo(float).tiny)
+        mixing_time = relaxation_time * np.log(1.0 / (epsilon * pi_min))
+        
+        return {
+            "time": hour,
+            "weather": weather,
+            "stationary": stationary.tolist(),
+            "expected_bikes": (stationary * np.sum(self.current_distribution)).tolist(),
+            "second_eigenvalue": float(second_eigenvalue),
+            "spectral_gap": float(gap),
+            "relaxation_time": float(relaxation_time),
+            "mixing_time": float(mixing_time)
+        }
+    
+    def _hourly_chain_matrix(self, hour, weather):
+        """Transition matrix M = (1 - p) I + p P of a single bike over one hour (dense or sparse)."""
+        departure_probability = self.time_of_day_factors[hour] * self.weather_factors[weather] * 0.3
+        matrix = self._effective_transition_matrix(hour, weather)
+        if sparse.issparse(matrix):
+            identity = sparse.identity(self.num_stations, format='csr')
+            return ((1 - departure_probability) * identity + departure_probability * matrix).tocsr()
+        if self.num_stations > STATIONARY_DENSE_MAX_STATIONS:
+            matrix = sparse.csr_matrix(matrix)
+            identity = sparse.identity(self.num_stations, format='csr')
+            return ((1 - departure_probability) * identity + departure_probability * matrix).tocsr()
+        return departure_probability * matrix + (1 - departure_probability) * np.eye(self.num_stations)
+    
+    def _solve_stationary(self, matrix):
+        """
+        Find the stationary distribution and second eigenvalue modulus of a chain.
+        
+        Returns:
+            A (stationary, second_eigenvalue_modulus) tuple.
+        """
+        if not sparse.issparse(matrix):
+            eigenvalues, eigenvectors = np.linalg.eig(matrix.T)
+            order = np.argsort(-np.abs(eigenvalues))
+            stationary = np.abs(np.real(eigenvectors[:, order[0]]))
+            second = np.abs(eigenvalues[order[1]]) if self.num_stations > 1 else 0.0
+            return stationary / stationary.sum(), float(second)
+        
+        try:
+            eigenvalues, eigenvectors = sparse_linalg.eigs(matrix.T, k=2, which='LM',
+                                                           tol=STATIONARY_TOLERANCE)
+            order = np.argsort(-np.abs(eigenvalues))
+            stationary = np.abs(np.real(eigenvectors[:, order[0]]))
+            return stationary / stationary.sum(), float(np.abs(eigenvalues[order[1]]))
+        except (sparse_linalg.ArpackNoConvergence, ValueError):
+            return self._power_iteration(matrix)
+    
+    def _power_iteration(self, matrix):
+        """
+        Power iteration with early stopping for the stationary distribution.
+        
+        The second eigenvalue modulus is estimated from the rate at which
+        successive differences shrink.
+        """
+        transposed = matrix.T.tocsr()
+        stationary = np.full(self.num_stations, 1.0 / self.num_stations)
+        previous_change = None
+        second = 0.0
+        
+        for _ in range(STATIONARY_MAX_ITERATIONS):
+            updated = transposed @ stationary
+            updated /= updated.sum()
+            change = np.abs(updated - stationary).sum()
+            stationary = updated
+            
+            if previous_change:
+                second = change / previous_change
+            if change < STATIONARY_TOLERANCE:
+                break
+            previous_change = change
+        
+        return stationary, float(min(second, 1.0))
+    
+    def memory_usage(self):
+        """Estimate the number of bytes held by the simulation's arrays and caches."""
+        total = 0
+        if self.current_distribution is not None:
+            total += self.current_distribution.nbytes + self.station_coords.nbytes
+        
+        if self.base_transition_matrix is not None:
+            base = self.base_transition_matrix
+            total += self._matrix_nbytes(base)
+            if sparse.issparse(base):
+                total += base.indices.nbytes + base.indptr.nbytes
+        
+        # Snapshot the caches so this can be called while another thread steps
+        total += sum(self._matrix_nbytes(matrix) for matrix in list(self._transition_bank.values()))
+        total += sum(probabilities.nbytes for probabilities in list(self._destination_cache.values()))
+        total += sum(matrix.nbytes for matrix in list(self._forecast_cache.values()))
+        total += sum(result[0].nbytes for result in list(self._stationary_cache.values()))
+        return total
+    
+    def snapshot_json(self):
+        """
+        Get the current state as UTF-8 JSON, serialized once per state version.
+        
+        Returns:
+            get_station_info() plus 'layout' and 'version', encoded as bytes.
+        """
+        key = (self.layout_id, self.state_version)
+        if self._snapshot_cache[0] != key:
+            snapshot = self.get_station_info()
+            snapshot["layout"] = self.layout_id
+            snapshot["version"] = self.state_version
+            self._snapshot_cache = (key, json.dumps(snapshot).encode())
+        return self._snapshot_cache[1]
+    
     def export_simulation_data(self):
         """Export the current simulation state as JSON for the frontend."""
-        return json.dumps(self.get_station_info())
+        return self.snapshot_json().decode()
 
 # For testing
 if __name__ == "__main__":
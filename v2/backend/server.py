@@ -1,15 +1,20 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from quantum import BikeRentalSimulation
 import json
-from gemini_service import get_all_explanations
+from gemini_service import (PREWARM_EXPLANATIONS, get_all_explanations, get_explanation_job,
+                            prewarm_explanations, service_stats, submit_explanation_job)
+import web
+from web import (create_registry, ensemble_response, forecast_response, session_id,
+                 station_response, step_response, stream_response)
 
 app = Flask(__name__)
 CORS(app)
 
-# Initialize the simulation
-simulation = BikeRentalSimulation(num_stations=10, num_bikes=100)
-simulation.initialize_system()
+def create_simulation():
+    """Create a simulation with this server's smaller default network, or from BIKESIM_STATIONS."""
+    return web.create_simulation(num_stations=10, num_bikes=100)
+
+registry = create_registry(create_simulation)
 
 @app.route('/api/explain', methods=['POST'])
 def explain_simulation():
@@ -17,8 +22,14 @@ def explain_simulation():
     data = request.json
     explanation_type = data.get('type', 'both')  # 'technical', 'non-technical', or 'both'
     
-    # Get current simulation state for context
-    simulation_state = json.loads(simulation.export_simulation_data())
+    # Get current simulation state for context; the model call runs without the session lock
+    with registry.session(session_id()) as simulation:
+        simulation_state = json.loads(simulation.export_simulation_data())
+    
+    # Asynchronous mode: hand back a job id at once and let the client poll for it
+    if data.get('async'):
+        job_id = submit_explanation_job(explanation_type, simulation_state)
+        return jsonify({'job': job_id, 'status': 'pending'}), 202
     
     try:
         # Get explanations from the Gemini service
@@ -37,52 +48,57 @@ def explain_simulation():
                 'non_technical': 'Error generating non-technical explanation.' if explanation_type in ['non-technical', 'both'] else ''
             }
         }), 500
-    
+
+@app.route('/api/explain/<job_id>', methods=['GET'])
+def explanation_job(job_id):
+    """Poll a background explanation job; ?wait=<seconds> long-polls until it finishes."""
+    job = get_explanation_job(job_id, wait_seconds=min(request.args.get('wait', 0, type=float), 30))
+    if job is None:
+        return jsonify({'error': f'Unknown explanation job: {job_id}'}), 404
+    return jsonify(job)
+
 @app.route('/api/init', methods=['GET'])
 def initialize():
-    global simulation
-    simulation = BikeRentalSimulation(num_stations=10, num_bikes=100)
-    simulation.initialize_system()
-    return simulation.get_station_info()
+    simulation = create_simulation()
+    registry.replace(session_id(), simulation)
+    return station_response(simulation)
 
 @app.route('/api/step', methods=['POST'])
 def step():
     data = request.get_json()
     use_quantum = data.get('useQuantum', True)
     
-    # Store previous distribution to calculate movement
-    previous_distribution = simulation.current_distribution.copy()
-    
-    if use_quantum:
-        simulation.run_quantum_step()
-    else:
-        simulation.run_classical_step()
-    
-    # Calculate actual bike movements
-    result = simulation.get_station_info()
-    
-    # Add movement data
-    movement_count = 0
-    for i in range(simulation.num_stations):
-        movement_count += abs(int(simulation.current_distribution[i]) - int(previous_distribution[i]))
-    
-    # Each bike counts twice (once leaving, once arriving)
-    result['movement'] = movement_count // 2
-    
-    return jsonify(result)
+    with registry.session(session_id()) as simulation:
+        # Store previous distribution to calculate movement
+        previous_distribution = simulation.current_distribution.copy()
+        
+        if use_quantum:
+            simulation.run_quantum_step()
+        else:
+            simulation.run_classical_step()
+        
+        # Calculate actual bike movements
+        movement_count = 0
+        for i in range(simulation.num_stations):
+            movement_count += abs(int(simulation.current_distribution[i]) - int(previous_distribution[i]))
+        
+        # Optionally have explanations of the new state ready before they are asked for
+        if data.get('prewarmExplanations', PREWARM_EXPLANATIONS):
+            prewarm_explanations(json.loads(simulation.export_simulation_data()))
+        
+        # Each bike counts twice (once leaving, once arriving)
+        return step_response(simulation, {'movement': movement_count // 2})
 
 @app.route('/api/advance_time', methods=['POST'])
 def advance_time():
     data = request.get_json()
     hours = data.get('hours', 1)
     
-    # Store previous distribution
-    previous_distribution = simulation.current_distribution.copy()
-    
-    simulation.advance_time(hours)
-    
-    # Get result with movement data
-    result = simulation.get_station_info()
+    with registry.session(session_id()) as simulation:
+        simulation.advance_time(hours)
+        
+        # Get result with movement data
+        result = simulation.get_station_info()
     
     # No movement occurs just from advancing time
     result['movement'] = 0
@@ -93,19 +109,21 @@ def advance_time():
 def set_weather():
     data = request.get_json()
     weather = data.get('weather')
-    success = simulation.set_weather(weather)
     
-    if success:
-        return jsonify({
-            "status": "success",
-            "message": f"Weather set to {weather}",
-            "data": simulation.get_station_info()
-        })
-    else:
-        return jsonify({
-            "status": "error",
-            "message": f"Invalid weather: {weather}"
-        }), 400
+    with registry.session(session_id()) as simulation:
+        success = simulation.set_weather(weather)
+        
+        if success:
+            return jsonify({
+                "status": "success",
+                "message": f"Weather set to {weather}",
+                "data": simulation.get_station_info()
+            })
+    
+    return jsonify({
+        "status": "error",
+        "message": f"Invalid weather: {weather}"
+    }), 400
 
 @app.route('/api/simulate_day', methods=['POST'])
 def simulate_day():
@@ -113,61 +131,71 @@ def simulate_day():
     use_quantum = data.get('useQuantum', True)
     
     # Track movement data for better usage metrics
-    results = []
-    
-    # Save original time
-    original_time = simulation.current_time
-    
-    # Run simulation for 24 hours
-    for hour in range(24):
-        # Store previous distribution
-        previous_distribution = simulation.current_distribution.copy()
+    with registry.session(session_id()) as simulation:
+        results = list(simulation.iter_hours(24, use_quantum))
         
-        # Run simulation step
-        if use_quantum:
-            simulation.run_quantum_step()
-        else:
-            simulation.run_classical_step()
-        
-        # Get state with movement data
-        result = simulation.get_station_info()
-        
-        # Calculate actual bike movements
-        movement_count = 0
-        for i in range(simulation.num_stations):
-            movement_count += abs(int(simulation.current_distribution[i]) - int(previous_distribution[i]))
-        
-        # Each bike counts twice (once leaving, once arriving)
-        result['movement'] = movement_count // 2
-        
-        # Add time-of-day factor to show expected activity levels
-        result['activity_factor'] = simulation.time_of_day_factors[simulation.current_time] * 20
-        
-        results.append(result)
-        simulation.advance_time(1)
-    
-    # Restore original time but keep final distribution
-    simulation.current_time = original_time
-    simulation.apply_time_and_weather_factors()
+        # Optionally have explanations of the new state ready before they are asked for
+        if data.get('prewarmExplanations', PREWARM_EXPLANATIONS):
+            prewarm_explanations(json.loads(simulation.export_simulation_data()))
     
     return jsonify(results)
 
+@app.route('/api/simulate_day_stream', methods=['POST'])
+def simulate_day_stream():
+    """Stream each simulated hour as soon as its step finishes."""
+    data = request.get_json()
+    use_quantum = data.get('useQuantum', True)
+    hours = data.get('hours', 24)
+    return stream_response(registry, hours, use_quantum)
+
+@app.route('/api/forecast', methods=['GET'])
+def forecast():
+    """Forecast the expected distribution ?hours=<n> ahead (default 6) without sampling."""
+    hours = request.args.get('hours', 6, type=int)
+    return forecast_response(registry, hours)
+
+@app.route('/api/stationary', methods=['GET'])
+def stationary():
+    """Long-run distribution and mixing time for ?time=<hour>&weather=<w> (defaults to the current ones)."""
+    hour = request.args.get('time', type=int)
+    weather = request.args.get('weather')
+    
+    with registry.session(session_id()) as simulation:
+        if weather is not None and weather not in simulation.weather_factors:
+            return jsonify({'error': f'Invalid weather: {weather}'}), 400
+        return jsonify(simulation.stationary_distribution(hour, weather))
+
+@app.route('/api/simulate_day_ensemble', methods=['POST'])
+def simulate_day_ensemble():
+    data = request.get_json()
+    replicas = data.get('replicas', 1000)
+    hours = data.get('hours', 24)
+    use_quantum = data.get('useQuantum', False)
+    return ensemble_response(registry, replicas, hours, use_quantum)
+
 @app.route('/api/debug', methods=['GET'])
 def debug_info():
     """Endpoint to help debug station placement issues"""
-    debug_data = {
-        "stations": [{
-            "id": i+1,
-            "location": {
-                "x": float(simulation.station_locations[i+1][0]),
-                "y": float(simulation.station_locations[i+1][1])
-            },
-            "bikes": int(simulation.current_distribution[i]),
-            "capacity": int(simulation.station_capacities[i])
-        } for i in range(simulation.num_stations)],
-        "map_dimensions": "10x10",
-        "station_locations_raw": {str(k): [float(v[0]), float(v[1])] for k, v in simulation.station_locations.items()}
-    }
+    def build(simulation):
+        locations = simulation.station_locations
+        return {
+            "stations": [{
+                "id": i+1,
+                "location": {
+                    "x": float(locations[i+1][0]),
+                    "y": float(locations[i+1][1])
+                },
+                "bikes": int(simulation.current_distribution[i]),
+                "capacity": int(simulation.station_capacities[i])
+            } for i in range(simulation.num_stations)],
+            "map_dimensions": "10x10",
+            "station_locations_raw": {str(k): [float(v[0]), float(v[1])] for k, v in locations.items()}
+        }
+    
+    # Read-only, so it goes through registry.read and never waits on a stepping request
+    debug_data = registry.read(session_id(), build)
+    debug_data["sessions"] = registry.stats()
+    debug_data["explanations"] = service_stats()
     return jsonify(debug_data)
 
 if __name__ == '__main__':
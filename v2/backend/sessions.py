@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Session used by clients that don't send an X-Session-ID header
+DEFAULT_SESSION_ID = 'default'
+
+
+class _Session:
+    """A simulation together with the lock serializing access to it."""
+    
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+
+
+class SimulationRegistry:
+    """
+    Keeps one BikeRentalSimulation per session so operators can run
+    independent scenarios against the same backend process.
+    
+    Sessions are evicted least-recently-used first when there are more than
+    max_sessions, when their combined memory exceeds max_bytes, or when they
+    have been idle for longer than idle_ttl seconds.
+    """
+    
+    def __init__(self, factory, max_sessions=32, idle_ttl=3600, max_bytes=1024 ** 3):
+        """
+        Initialize the registry.
+        
+        Args:
+            factory: Callable returning a new, initialized simulation for an unknown session
+            max_sessions: Maximum number of sessions kept at once
+            idle_ttl: Seconds after which an unused session is dropped
+            max_bytes: Memory budget for all sessions' simulation arrays
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def session(self, session_id):
+        """
+        Hold a session's lock and yield its simulation, creating it if needed.
+        
+        Args:
+            session_id: Identifier of the session
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._touch(session_id, entry)
+        
+        if entry is None:
+            # Build outside the registry lock so other sessions aren't held up
+            simulation = self.factory()
+            with self._lock:
+                # Another request may have created the session in the meantime
+                entry = self._sessions.get(session_id)
+                if entry is None:
+                    entry = _Session(simulation)
+                    self._sessions[session_id] = entry
+                self._touch(session_id, entry)
+        
+        with entry.lock:
+            yield entry.simulation
+    
+    def read(self, session_id, build):
+        """
+        Build a response from a session's simulation while holding its lock.
+        
+        Args:
+            session_id: Identifier of the session
+            build: Callable taking the simulation and returning the response
+            
+        Returns:
+            Whatever build returns.
+        """
+        with self.session(session_id) as simulation:
+            return build(simulation)
+    
+    def replace(self, session_id, simulation):
+        """
+        Install a new simulation for a session, e.g. after /api/init or /api/config.
+        
+        Args:
+            session_id: Identifier of the session
+            simulation: Initialized simulation to use from now on
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = _Session(simulation)
+                self._sessions[session_id] = entry
+        
+        # Swap under the session lock so in-flight requests finish on the old one
+        with entry.lock:
+            # Keep versions increasing across simulations so a client's
+            # ?since=<old version> gets a full snapshot rather than a delta
+            if entry.simulation is not simulation:
+                simulation.reset_state_version(max(simulation.state_version,
+                                                   entry.simulation.state_version + 1))
+            entry.simulation = simulation
+        
+        with self._lock:
+            if self._sessions.get(session_id) is entry:
+                self._touch(session_id, entry)
+    
+    def stats(self):
+        """Get the number of live sessions and their estimated memory use."""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': sum(entry.simulation.memory_usage() for entry in self._sessions.values())
+            }
+    
+    def _touch(self, session_id, entry):
+        """Mark a session as most recently used and apply the eviction policy."""
+        entry.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        self._evict(keep=session_id)
+    
+    def _evict(self, keep):
+        """Drop idle, surplus and over-budget sessions, oldest first (caller holds the lock)."""
+        now = time.monotonic()
+        for session_id in [sid for sid, entry in self._sessions.items()
+                           if sid != keep and now - entry.last_used > self.idle_ttl]:
+            del self._sessions[session_id]
+        
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        
+        total_bytes = sum(entry.simulation.memory_usage() for entry in self._sessions.values())
+        for session_id in list(self._sessions):
+            if total_bytes <= self.max_bytes or session_id == keep:
+                break
+            total_bytes -= self._sessions.pop(session_id).simulation.memory_usage()
@@ -0,0 +1,525 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from scipy import sparse
+
+from quantum import WEATHER_CONDITIONS, BikeRentalSimulation
+
+# Header slots (int64) at the start of the shared state
+_GENERATION = 0      # Even when consistent, odd while a writer is publishing
+_LAYOUT = 1          # Bumped whenever the station network itself is replaced
+_NUM_STATIONS = 2
+_NUM_BIKES = 3
+_TIME = 4
+_WEATHER = 5         # Index into WEATHER_CONDITIONS
+_MATRIX_WIDTH = 6    # 0 for a dense matrix, entries per row for a sparse one
+_STATE_VERSION = 7   # The published simulation's state_version
+_ID_WIDTH = 8        # Characters per source station id, 0 when stations have none
+_HEADER_SLOTS = 9
+
+# How long read() retries lock-free before taking the write lock instead, e.g.
+# because a writer died halfway through a publish and left the generation odd
+READ_RETRY_SECONDS = 1.0
+
+
+def _open_block(name, size=None):
+    """
+    Create (when size is given) or attach to a named shared memory block.
+    
+    Blocks outlive the process that created them: the resource tracker is told
+    to forget them so a worker exiting doesn't unlink state others still use.
+    """
+    if size is None:
+        block = shared_memory.SharedMemory(name=name)
+    else:
+        block = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+
+def _unlink_block(name):
+    """Remove a named shared memory block if it still exists."""
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.unlink()
+    block.close()
+
+
+class SharedSimulationState:
+    """
+    Simulation state stored in multiprocessing.shared_memory blocks so that
+    every worker of a multi-process deployment sees the same scenario.
+    
+    Writers serialize on a cross-process file lock and bump a generation
+    counter around each publish; readers never lock and instead retry if the
+    generation moved while they were reading.
+    """
+    
+    def __init__(self, name):
+        """
+        Attach to (or create) the shared state with the given name.
+        
+        Args:
+            name: Prefix for the shared memory blocks and the lock file
+        """
+        self.name = name
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f'{name}.lock'), 'a+')
+        # flock only excludes other processes; threads of this one queue here first
+        self._thread_lock = threading.Lock()
+        self._blocks = {}
+        self._arrays = {}
+        self._attached_layout = None
+        # Closing a block unmaps it even while numpy views of it exist, so the
+        # blocks of a replaced layout are kept until no view in this process
+        # uses them; _readers counts live views per layout
+        self._mapping_lock = threading.Lock()
+        self._retired = []
+        self._readers = {}
+        # ((layout_id, state_version), JSON bytes) shared by this process's views
+        self._snapshot_cache = (None, None)
+        
+        with self.write_lock():
+            try:
+                header = _open_block(f'{name}_header')
+            except FileNotFoundError:
+                header = _open_block(f'{name}_header', _HEADER_SLOTS * 8)
+                np.ndarray(_HEADER_SLOTS, dtype=np.int64, buffer=header.buf)[:] = 0
+        self._header_block = header
+        self.header = np.ndarray(_HEADER_SLOTS, dtype=np.int64, buffer=header.buf)
+    
+    @property
+    def generation(self):
+        """Current generation counter."""
+        return int(self.header[_GENERATION])
+    
+    @property
+    def is_initialized(self):
+        """Whether a simulation has been published yet."""
+        return self.header[_LAYOUT] > 0
+    
+    @contextmanager
+    def write_lock(self):
+        """Hold the write lock against other threads and other processes."""
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+    
+    def arrays(self):
+        """
+        Get zero-copy views of the shared arrays for the current layout.
+        
+        Returns:
+            A dictionary with 'distribution', 'capacities', 'coords' and the
+            transition matrix arrays ('matrix', or 'data'/'indices'/'indptr').
+        """
+        with self._mapping_lock:
+            layout = int(self.header[_LAYOUT])
+            if layout != self._attached_layout:
+                self._attach(layout)
+            return self._arrays
+    
+    def publish_layout(self, simulation):
+        """
+        Replace the whole shared network with a simulation's (caller holds the write lock).
+        
+        Args:
+            simulation: Initialized simulation whose network and state are shared
+        """
+        old_layout = int(self.header[_LAYOUT])
+        layout = old_layout + 1
+        base = simulation.base_transition_matrix
+        
+        shapes = {
+            'distribution': ((simulation.num_stations,), np.int64),
+            'capacities': ((simulation.num_stations,), np.int64),
+            'coords': ((simulation.num_stations, 2), np.float64),
+        }
+        if sparse.issparse(base):
+            shapes['data'] = (base.data.shape, np.float64)
+            shapes['indices'] = (base.indices.shape, np.int64)
+            shapes['indptr'] = (base.indptr.shape, np.int64)
+        else:
+            shapes['matrix'] = (base.shape, np.float64)
+        id_width = 0
+        if simulation.station_ids is not None:
+            id_width = max(simulation.station_ids.dtype.itemsize // 4, 1)
+            shapes['ids'] = ((simulation.num_stations,), f'<U{id_width}')
+        
+        blocks = {}
+        for key, (shape, dtype) in shapes.items():
+            block = _open_block(f'{self.name}_{layout}_{key}', int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            blocks[key] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+        
+        arrays = {key: array for key, (_, array) in blocks.items()}
+        arrays['capacities'][:] = np.asarray(simulation.station_capacities[:simulation.num_stations])
+        arrays['coords'][:] = simulation.station_coords
+        if sparse.issparse(base):
+            arrays['data'][:] = base.data
+            arrays['indices'][:] = base.indices
+            arrays['indptr'][:] = base.indptr
+        else:
+            arrays['matrix'][:] = base
+        if id_width:
+            arrays['ids'][:] = simulation.station_ids
+        
+        self.header[_GENERATION] += 1
+        arrays['distribution'][:] = simulation.current_distribution
+        self.header[_LAYOUT] = layout
+        self.header[_NUM_STATIONS] = simulation.num_stations
+        self.header[_NUM_BIKES] = simulation.num_bikes
+        self.header[_MATRIX_WIDTH] = base.indptr[1] if sparse.issparse(base) else 0
+        self.header[_ID_WIDTH] = id_width
+        # Keep versions increasing across layouts so stale clients get a full snapshot
+        simulation.reset_state_version(max(simulation.state_version, int(self.header[_STATE_VERSION]) + 1))
+        self._write_clock(simulation)
+        self.header[_GENERATION] += 1
+        
+        # Workers still mapping the old layout keep their mapping until they re-attach
+        with self._mapping_lock:
+            self._retire_blocks()
+            self._blocks = {key: block for key, (block, _) in blocks.items()}
+            self._arrays = arrays
+            self._attached_layout = layout
+        if old_layout:
+            for key in ('distribution', 'capacities', 'coords', 'matrix', 'data', 'indices', 'indptr', 'ids'):
+                _unlink_block(f'{self.name}_{old_layout}_{key}')
+    
+    def publish_state(self, simulation):
+        """
+        Publish a simulation's distribution, time and weather (caller holds the write lock).
+        
+        Args:
+            simulation: Simulation on the current shared layout
+        """
+        arrays = self.arrays()
+        self.header[_GENERATION] += 1
+        arrays['distribution'][:] = simulation.current_distribution
+        self._write_clock(simulation)
+        self.header[_GENERATION] += 1
+    
+    def load_into(self, simulation):
+        """
+        Copy the shared distribution, time and weather into a local simulation.
+        
+        Nothing is copied when the simulation already holds the published
+        state version, which keeps its change log for delta updates.
+        
+        Args:
+            simulation: Simulation on the current shared layout
+        """
+        version = int(self.header[_STATE_VERSION])
+        if simulation.state_version == version:
+            return
+        
+        simulation.current_distribution = self.arrays()['distribution'].copy()
+        simulation.current_time = int(self.header[_TIME])
+        simulation.current_weather = WEATHER_CONDITIONS[int(self.header[_WEATHER])]
+        simulation.apply_time_and_weather_factors()
+        simulation.reset_state_version(version)
+    
+    def build_simulation(self):
+        """
+        Create a local simulation on the shared layout, reusing the shared base matrix.
+        
+        Returns:
+            An initialized BikeRentalSimulation.
+        """
+        arrays = self.arrays()
+        num_stations = int(self.header[_NUM_STATIONS])
+        width = int(self.header[_MATRIX_WIDTH])
+        
+        if width:
+            base = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                     shape=(num_stations, num_stations))
+        else:
+            base = arrays['matrix']
+        
+        simulation = BikeRentalSimulation(num_stations=num_stations,
+                                          num_bikes=int(self.header[_NUM_BIKES]),
+                                          neighbors=width - 1 if width else None)
+        simulation.load_layout(arrays['coords'], arrays['capacities'], arrays['distribution'], base,
+                               station_ids=arrays.get('ids'))
+        simulation.layout_id = self.layout_id
+        self.load_into(simulation)
+        return simulation
+    
+    @property
+    def layout_id(self):
+        """Layout identifier shared by every worker for the current network."""
+        return f'{self.name}-{int(self.header[_LAYOUT])}'
+    
+    def view(self):
+        """
+        Get a read-only view of the shared state for serving read endpoints.
+        
+        The arrays it holds stay mapped for as long as the view is alive,
+        even if the layout is replaced in the meantime.
+        
+        Returns:
+            A SharedStateView over the current arrays.
+        """
+        with self._mapping_lock:
+            layout = int(self.header[_LAYOUT])
+            if layout != self._attached_layout:
+                self._attach(layout)
+            layout, arrays = self._attached_layout, self._arrays
+            self._readers[layout] = self._readers.get(layout, 0) + 1
+        
+        view = SharedStateView(self, arrays)
+        weakref.finalize(view, self._release_view, layout)
+        return view
+    
+    def recover_generation(self):
+        """
+        Make an odd generation left by a writer that died mid-publish even again
+        (caller holds the write lock, so no live writer can be publishing).
+        """
+        if self.generation % 2:
+            self.header[_GENERATION] += 1
+    
+    def _write_clock(self, simulation):
+        """Store the simulation's time, weather and state version in the header."""
+        self.header[_STATE_VERSION] = simulation.state_version
+        self.header[_TIME] = simulation.current_time
+        self.header[_WEATHER] = WEATHER_CONDITIONS.index(simulation.current_weather)
+    
+    def _attach(self, layout):
+        """Map the blocks of a layout published by another process (caller holds _mapping_lock)."""
+        num_stations = int(self.header[_NUM_STATIONS])
+        width = int(self.header[_MATRIX_WIDTH])
+        
+        shapes = {
+            'distribution': ((num_stations,), np.int64),
+            'capacities': ((num_stations,), np.int64),
+            'coords': ((num_stations, 2), np.float64),
+        }
+        if width:
+            shapes['data'] = ((num_stations * width,), np.float64)
+            shapes['indices'] = ((num_stations * width,), np.int64)
+            shapes['indptr'] = ((num_stations + 1,), np.int64)
+        else:
+            shapes['matrix'] = ((num_stations, num_stations), np.float64)
+        id_width = int(self.header[_ID_WIDTH])
+        if id_width:
+            shapes['ids'] = ((num_stations,), f'<U{id_width}')
+        
+        blocks, arrays = {}, {}
+        try:
+            for key, (shape, dtype) in shapes.items():
+                blocks[key] = _open_block(f'{self.name}_{layout}_{key}')
+                arrays[key] = np.ndarray(shape, dtype=dtype, buffer=blocks[key].buf)
+        except FileNotFoundError:
+            # Already replaced again and unlinked; the caller retries
+            arrays.clear()
+            for block in blocks.values():
+                block.close()
+            raise
+        
+        self._retire_blocks()
+        self._blocks = blocks
+        self._arrays = arrays
+        self._attached_layout = layout
+    
+    def _retire_blocks(self):
+        """Stop using the attached layout's blocks, closing them once unused (caller holds _mapping_lock)."""
+        if self._blocks:
+            self._retired.append((self._attached_layout, self._blocks))
+        self._blocks = {}
+        self._arrays = {}
+        self._close_retired()
+    
+    def _close_retired(self):
+        """Unmap retired layouts no live view uses any more (caller holds _mapping_lock)."""
+        retired = []
+        for layout, blocks in self._retired:
+            if self._readers.get(layout):
+                retired.append((layout, blocks))
+                continue
+            for block in blocks.values():
+                block.close()
+        self._retired = retired
+    
+    def _release_view(self, layout):
+        """Forget a view that was garbage collected and unmap what it kept alive."""
+        with self._mapping_lock:
+            self._readers[layout] -= 1
+            if not self._readers[layout]:
+                del self._readers[layout]
+            self._close_retired()
+
+
+class SharedStateView:
+    """Read-only, zero-copy view of shared state with the simulation's read API."""
+    
+    def __init__(self, state, arrays):
+        self._state = state
+        self._generation = state.generation
+        self.num_stations = len(arrays['distribution'])
+        self.current_distribution = arrays['distribution']
+        self.station_capacities = arrays['capacities']
+        self.station_coords = arrays['coords']
+        self.station_ids = arrays.get('ids')
+        self.current_time = int(state.header[_TIME])
+        self.current_weather = WEATHER_CONDITIONS[int(state.header[_WEATHER])]
+        self.layout_id = state.layout_id
+        self.state_version = int(state.header[_STATE_VERSION])
+    
+    @property
+    def station_locations(self):
+        """Station coordinates keyed by 1-based station id."""
+        return {i + 1: (x, y) for i, (x, y) in enumerate(self.station_coords.tolist())}
+    
+    def get_station_info(self):
+        """Get information about all stations for visualization."""
+        info = {
+            "stations": [
+                {
+                    "id": i + 1,  # 1-based indexing
+                    "bikes": bikes,
+                    "capacity": capacity,
+                    "location": {"x": x, "y": y}
+                }
+                for i, (bikes, capacity, (x, y)) in enumerate(zip(self.current_distribution.tolist(),
+                                                                  self.station_capacities.tolist(),
+                                                                  self.station_coords.tolist()))
+            ],
+            "time": self.current_time,
+            "weather": self.current_weather,
+            "total_bikes": int(np.sum(self.current_distribution))
+        }
+        
+        if self.station_ids is not None:
+            for station, station_id in zip(info["stations"], self.station_ids.tolist()):
+                station["station_id"] = station_id
+        return info
+    
+    def snapshot_json(self):
+        """Get the current state as UTF-8 JSON, serialized once per state version in this process."""
+        key = (self.layout_id, self.state_version)
+        cached_key, cached = self._state._snapshot_cache
+        if cached_key == key:
+            return cached
+        
+        snapshot = self.get_station_info()
+        snapshot["layout"] = self.layout_id
+        snapshot["version"] = self.state_version
+        body = json.dumps(snapshot).encode()
+        
+        # Only cache what was read while no writer was publishing
+        if self._generation % 2 == 0 and self._state.generation == self._generation:
+            self._state._snapshot_cache = (key, body)
+        return body
+    
+    def export_simulation_data(self):
+        """Export the current simulation state as JSON for the frontend."""
+        return self.snapshot_json().decode()
+
+
+class SharedSimulationRegistry:
+    """
+    Registry with the SimulationRegistry interface backed by shared memory.
+    
+    All workers serve one shared scenario, so session ids are ignored. Stepping
+    requests take the cross-process write lock, sync a worker-local simulation
+    from shared memory and publish the result; reads go through read() without
+    any lock.
+    """
+    
+    def __init__(self, name, factory):
+        """
+        Initialize the registry.
+        
+        Args:
+            name: Name of the shared state, the same for every worker
+            factory: Callable returning a new, initialized simulation
+        """
+        self.state = SharedSimulationState(name)
+        self.factory = factory
+        self._simulation = None
+        self._layout = None
+        
+        with self.state.write_lock():
+            if not self.state.is_initialized:
+                self.state.publish_layout(factory())
+    
+    @contextmanager
+    def session(self, session_id):
+        """Hold the write lock and yield a simulation synced with shared memory."""
+        with self.state.write_lock():
+            simulation = self._local_simulation()
+            yield simulation
+            self.state.publish_state(simulation)
+    
+    def replace(self, session_id, simulation):
+        """Publish a new simulation as the shared scenario."""
+        with self.state.write_lock():
+            self.state.publish_layout(simulation)
+            simulation.layout_id = self.state.layout_id
+            self._simulation = simulation
+            self._layout = int(self.state.header[_LAYOUT])
+    
+    def read(self, session_id, build):
+        """
+        Build a response from a zero-copy view of the shared state without locking.
+        
+        Args:
+            session_id: Ignored; every worker serves the shared scenario
+            build: Side-effect-free callable taking the view and returning the
+                response; it is re-run if a writer published in the meantime
+        
+        Returns:
+            Whatever build returns for a consistent generation.
+        """
+        deadline = time.monotonic() + READ_RETRY_SECONDS
+        while True:
+            if time.monotonic() > deadline:
+                # Stop spinning: writers are either done or died mid-publish
+                with self.state.write_lock():
+                    self.state.recover_generation()
+                    return build(self.state.view())
+            
+            generation = self.state.generation
+            if generation % 2:
+                time.sleep(0)
+                continue
+            layout = int(self.state.header[_LAYOUT])
+            try:
+                result = build(self.state.view())
+            except (FileNotFoundError, ValueError):
+                # Retry only if the layout was replaced under us and its blocks
+                # are already gone; anything else is a genuine error
+                if int(self.state.header[_LAYOUT]) == layout:
+                    raise
+                continue
+            if self.state.generation == generation:
+                return result
+    
+    def stats(self):
+        """Get the number of live sessions and the shared generation counter."""
+        return {
+            'sessions': 1,
+            'generation': self.state.generation
+        }
+    
+    def _local_simulation(self):
+        """Get this worker's simulation, rebuilt if another worker replaced the layout."""
+        layout = int(self.state.header[_LAYOUT])
+        if self._simulation is None or self._layout != layout:
+            self._simulation = self.state.build_simulation()
+            self._layout = layout
+        else:
+            self.state.load_into(self._simulation)
+        return self._simulation
@@ -0,0 +1,99 @@
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # Optional: without it clients get the JSON encoding
+    msgpack = None
+
+# Media type clients put in their Accept header to get the binary encoding
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def msgpack_available():
+    """Whether the binary snapshot encoding can be served."""
+    return msgpack is not None
+
+
+def encode_station_columns(simulation, known_layout=None, extra=None):
+    """
+    Encode station state as typed columns in a MessagePack map.
+    
+    Per-station values are raw little-endian array payloads (int16 bikes and
+    capacities, float32 x/y) in station order, station i having id i+1. The
+    static columns, including the list of source 'station_ids' for stations
+    loaded from an inventory, are left out when the client already holds the layout.
+    
+    Args:
+        simulation: Simulation (or shared state view) to encode
+        known_layout: layout_id the client has cached static columns for
+        extra: Optional dictionary of additional scalar fields, e.g. movement
+        
+    Returns:
+        The encoded snapshot as bytes.
+    """
+    snapshot = {
+        "layout": simulation.layout_id,
+        "version": simulation.state_version,
+        "num_stations": simulation.num_stations,
+        "time": simulation.current_time,
+        "weather": simulation.current_weather,
+        "total_bikes": int(np.sum(simulation.current_distribution)),
+        "bikes": np.asarray(simulation.current_distribution, dtype='<i2').tobytes(),
+    }
+    
+    if known_layout != simulation.layout_id:
+        coords = np.asarray(simulation.station_coords, dtype='<f4')
+        snapshot["capacities"] = np.asarray(simulation.station_capacities[:simulation.num_stations],
+                                            dtype='<i2').tobytes()
+        snapshot["x"] = np.ascontiguousarray(coords[:, 0]).tobytes()
+        snapshot["y"] = np.ascontiguousarray(coords[:, 1]).tobytes()
+        if simulation.station_ids is not None:
+            snapshot["station_ids"] = simulation.station_ids.tolist()
+    
+    if extra:
+        snapshot.update(extra)
+    
+    return msgpack.packb(snapshot, use_bin_type=True)
+
+
+def station_delta(simulation, changed, extra=None):
+    """
+    Describe only the stations that changed since a client's state version.
+    
+    Args:
+        simulation: Simulation to describe
+        changed: 0-based indices of the changed stations, from changes_since()
+        extra: Optional dictionary of additional fields, e.g. movement
+        
+    Returns:
+        A dictionary with the version, time, weather and [station_id, bikes]
+        pairs for the changed stations.
+    """
+    delta = {
+        "layout": simulation.layout_id,
+        "version": simulation.state_version,
+        "time": simulation.current_time,
+        "weather": simulation.current_weather,
+        "total_bikes": int(np.sum(simulation.current_distribution)),
+        "changes": [[int(i) + 1, int(simulation.current_distribution[i])] for i in changed]
+    }
+    delta.update(extra or {})
+    return delta
+
+
+def encode_station_delta(simulation, changed, extra=None):
+    """
+    Binary counterpart of station_delta, with the changed stations as raw
+    little-endian int32 'ids' (1-based) and int16 'bikes' columns.
+    """
+    delta = {
+        "layout": simulation.layout_id,
+        "version": simulation.state_version,
+        "time": simulation.current_time,
+        "weather": simulation.current_weather,
+        "total_bikes": int(np.sum(simulation.current_distribution)),
+        "ids": (np.asarray(changed, dtype='<i4') + 1).tobytes(),
+        "bikes": np.asarray(simulation.current_distribution, dtype='<i2')[changed].tobytes()
+    }
+    delta.update(extra or {})
+    return msgpack.packb(delta, use_bin_type=True)
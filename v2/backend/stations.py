@@ -0,0 +1,220 @@
+import csv
+import json
+import os
+import tempfile
+import zipfile
+from array import array
+
+import numpy as np
+
+from quantum import neighborhood_densities
+
+# Bumped whenever the layout of the preprocessed cache files changes
+_CACHE_FORMAT = 2
+
+# Accepted column / property names for each field, lower case
+_FIELD_NAMES = {
+    'id': ('id', 'station_id', 'short_name'),
+    'lat': ('lat', 'latitude'),
+    'lon': ('lon', 'lng', 'long', 'longitude'),
+    'capacity': ('capacity', 'docks', 'dock_count'),
+    'neighborhood': ('neighborhood', 'neighbourhood', 'area'),
+}
+
+
+class StationInventory:
+    """
+    A station network as compact columns, one entry per station.
+    
+    Attributes:
+        ids: station ids from the source file as strings (e.g. GBFS UUIDs or 'HB101')
+        lat: float64 latitudes
+        lon: float64 longitudes
+        capacities: int32 number of docks
+        neighborhoods: int16 index into neighborhood_names (-1 if unknown)
+        neighborhood_names: list of the distinct neighborhood names
+    """
+    
+    def __init__(self, ids, lat, lon, capacities, neighborhoods, neighborhood_names):
+        self.ids = ids
+        self.lat = lat
+        self.lon = lon
+        self.capacities = capacities
+        self.neighborhoods = neighborhoods
+        self.neighborhood_names = list(neighborhood_names)
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def coords(self, extent=10.0, margin=0.5):
+        """
+        Project the stations onto the simulation's square map.
+        
+        Uses an equirectangular projection around the network's mean latitude
+        and keeps the aspect ratio.
+        
+        Args:
+            extent: Side length of the map
+            margin: Empty border left on every side
+            
+        Returns:
+            A float64 array of (x, y) coordinates, shape (num_stations, 2).
+        """
+        x = self.lon * np.cos(np.radians(self.lat.mean()))
+        y = self.lat
+        span = max(np.ptp(x), np.ptp(y)) or 1.0
+        scale = (extent - 2 * margin) / span
+        return np.column_stack([margin + (x - x.min()) * scale,
+                                margin + (y - y.min()) * scale])
+
+
+def load_station_inventory(path, use_cache=True):
+    """
+    Load a station inventory from CSV or GeoJSON.
+    
+    The file is read in a single streaming pass (CSV rows, or one GeoJSON
+    feature per line for .geojsonl/.geojsons files). The parsed columns are
+    cached next to it as <path>.npz and reused while the source is unchanged;
+    if that directory isn't writable the inventory is simply parsed each time.
+    
+    Args:
+        path: CSV with id, lat, lon, capacity and neighborhood columns, or a
+            GeoJSON FeatureCollection (or line-delimited features) of points
+            with id, capacity and neighborhood properties
+        use_cache: Whether to read and write the preprocessed cache
+        
+    Returns:
+        A StationInventory.
+    """
+    cache_path = f'{path}.npz'
+    stat = os.stat(path)
+    source = np.array([_CACHE_FORMAT, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    
+    if use_cache:
+        inventory = _read_cache(cache_path, source)
+        if inventory is not None:
+            return inventory
+    
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        records = _read_csv(path)
+    elif extension in ('.geojsonl', '.geojsons', '.ndjson'):
+        records = _read_geojson_lines(path)
+    elif extension in ('.geojson', '.json'):
+        records = _read_geojson(path)
+    else:
+        raise ValueError(f'Unsupported station inventory format: {path}')
+    
+    inventory = _build_inventory(records)
+    
+    if use_cache:
+        _write_cache(cache_path, source, inventory)
+    return inventory
+
+
+def _read_cache(cache_path, source):
+    """Load a cached inventory, or None if it is missing, stale or unreadable."""
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as data:
+            if not np.array_equal(data['source'], source):
+                return None
+            return StationInventory(data['ids'], data['lat'], data['lon'], data['capacities'],
+                                    data['neighborhoods'], data['neighborhood_names'].tolist())
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None  # e.g. truncated by a crash, or written by something else; rebuilt
+
+
+def _write_cache(cache_path, source, inventory):
+    """Write the cache to a temporary file and move it into place, so readers never see a partial one."""
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path) or '.', suffix='.npz',
+                                         delete=False) as f:
+            temp_path = f.name
+            np.savez(f, source=source, ids=inventory.ids, lat=inventory.lat, lon=inventory.lon,
+                     capacities=inventory.capacities, neighborhoods=inventory.neighborhoods,
+                     neighborhood_names=np.array(inventory.neighborhood_names, dtype=str))
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # e.g. a read-only inventory directory or a full disk
+        if temp_path is not None and os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def _field(record, field):
+    """Get a field from a row or properties dict under any of its accepted names."""
+    for name in _FIELD_NAMES[field]:
+        value = record.get(name)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _read_csv(path):
+    """Yield (id, lat, lon, capacity, neighborhood) for each CSV row."""
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            yield (_field(row, 'id'), _field(row, 'lat'), _field(row, 'lon'),
+                   _field(row, 'capacity'), _field(row, 'neighborhood'))
+
+
+def _feature_record(feature):
+    """Convert a GeoJSON point feature to an (id, lat, lon, capacity, neighborhood) record."""
+    properties = {key.lower(): value for key, value in (feature.get('properties') or {}).items()}
+    lon, lat = feature['geometry']['coordinates'][:2]
+    station_id = _field(properties, 'id')
+    return (feature.get('id') if station_id is None else station_id, lat, lon,
+            _field(properties, 'capacity'), _field(properties, 'neighborhood'))
+
+
+def _read_geojson(path):
+    """Yield a record for each feature of a GeoJSON FeatureCollection."""
+    with open(path) as f:
+        collection = json.load(f)
+    for feature in collection.get('features', []):
+        yield _feature_record(feature)
+
+
+def _read_geojson_lines(path):
+    """Yield a record for each feature of a line-delimited GeoJSON file."""
+    with open(path) as f:
+        for line in f:
+            line = line.strip().lstrip('\x1e')  # RFC 8142 record separators
+            if line:
+                yield _feature_record(json.loads(line))
+
+
+def _build_inventory(records):
+    """Accumulate records into compact arrays in one pass."""
+    ids = []
+    lat, lon, capacities, neighborhoods = array('d'), array('d'), array('i'), array('h')
+    names = {}
+    
+    for index, (station_id, station_lat, station_lon, capacity, neighborhood) in enumerate(records):
+        if station_lat is None or station_lon is None:
+            raise ValueError(f'Station {station_id if station_id is not None else index} has no location')
+        
+        ids.append(str(station_id).strip() if station_id is not None else str(index + 1))
+        lat.append(float(station_lat))
+        lon.append(float(station_lon))
+        
+        # Stations without a known capacity get one from their neighborhood's density
+        if capacity is None:
+            density = neighborhood_densities.get(neighborhood, 50000)
+            capacity = np.interp(density, [45000, 130000], [10, 30])
+        capacities.append(int(float(capacity)))
+        neighborhoods.append(names.setdefault(neighborhood, len(names)) if neighborhood else -1)
+    
+    if not ids:
+        raise ValueError('Station inventory is empty')
+    
+    return StationInventory(np.array(ids, dtype=str),
+                            np.frombuffer(lat, dtype=np.float64),
+                            np.frombuffer(lon, dtype=np.float64),
+                            np.frombuffer(capacities, dtype=np.intc),
+                            np.frombuffer(neighborhoods, dtype=np.int16),
+                            list(names))
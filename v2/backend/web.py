@@ -0,0 +1,226 @@
+import copy
+import json
+import os
+import queue
+import threading
+
+from flask import Response, jsonify, request
+
+import parallel
+from quantum import BikeRentalSimulation
+from sessions import SimulationRegistry, DEFAULT_SESSION_ID
+from shared_state import SharedSimulationRegistry
+from snapshot import (MSGPACK_MIMETYPE, encode_station_columns, encode_station_delta,
+                      msgpack_available, station_delta)
+from stations import load_station_inventory
+
+# Optional station inventory (CSV or GeoJSON) replacing the generated layout
+STATION_INVENTORY = os.environ.get('BIKESIM_STATIONS')
+
+# Networks larger than this use a sparse k-nearest-neighbour transition matrix
+SPARSE_NETWORK_STATIONS = 1000
+SPARSE_NEIGHBORS = 32
+
+# Longest run /api/simulate_day_stream will simulate in one request (a year);
+# the session is only held one hour at a time, so this just bounds runaway requests
+MAX_STREAM_HOURS = 24 * 365
+
+# Frames simulated ahead of a slow client before the stream stops stepping
+STREAM_BUFFER_FRAMES = 4
+
+
+def create_simulation(num_stations=20, num_bikes=250):
+    """Create and initialize a simulation, or load it from BIKESIM_STATIONS when set."""
+    if STATION_INVENTORY:
+        inventory = load_station_inventory(STATION_INVENTORY)
+        neighbors = SPARSE_NEIGHBORS if len(inventory) > SPARSE_NETWORK_STATIONS else None
+        # The fleet fills half of the inventory's docks
+        simulation = BikeRentalSimulation(num_stations=len(inventory),
+                                          num_bikes=int(inventory.capacities.sum()) // 2,
+                                          neighbors=neighbors)
+        simulation.load_inventory(inventory)
+        return simulation
+    
+    neighbors = SPARSE_NEIGHBORS if num_stations > SPARSE_NETWORK_STATIONS else None
+    simulation = BikeRentalSimulation(num_stations=num_stations, num_bikes=num_bikes, neighbors=neighbors)
+    simulation.initialize_system()
+    return simulation
+
+
+def create_registry(factory):
+    """
+    Create the registry serving the app's simulations: one per session
+    (X-Session-ID header), each guarded by its own lock, or with
+    BIKESIM_SHARED_STATE set, one scenario shared by all worker processes.
+    
+    Args:
+        factory: Callable returning a new, initialized simulation
+    """
+    if os.environ.get('BIKESIM_SHARED_STATE'):
+        return SharedSimulationRegistry(os.environ['BIKESIM_SHARED_STATE'], factory)
+    return SimulationRegistry(factory)
+
+
+def bounded_int(value, name, low, high):
+    """
+    Validate an integer request parameter.
+    
+    Raises:
+        ValueError: If value isn't an integer between low and high (inclusive).
+    """
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise ValueError(f'{name} must be an integer between {low} and {high}')
+    return value
+
+
+def session_id():
+    """Get the session the current request belongs to."""
+    return request.headers.get('X-Session-ID') or request.args.get('session', DEFAULT_SESSION_ID)
+
+
+def wants_msgpack():
+    """Whether the client prefers the binary MessagePack encoding and it is available."""
+    return (msgpack_available() and
+            request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE)
+
+
+def station_response(simulation, extra=None):
+    """
+    Respond with the station state as JSON or, for clients accepting
+    application/msgpack, as binary columns (static ones only when the
+    client's X-Layout-Version is stale).
+    """
+    if wants_msgpack():
+        body = encode_station_columns(simulation, request.headers.get('X-Layout-Version'), extra)
+        response = Response(body, mimetype=MSGPACK_MIMETYPE, headers={'X-Layout-Version': simulation.layout_id})
+    elif extra is None:
+        # Serialized once per state version; pollers with a current ETag get a 304
+        response = Response(simulation.snapshot_json(), mimetype='application/json')
+        response.set_etag(f'{simulation.layout_id}-{simulation.state_version}')
+        response = response.make_conditional(request)
+    else:
+        result = simulation.get_station_info()
+        result['layout'] = simulation.layout_id
+        result['version'] = simulation.state_version
+        result.update(extra)
+        response = jsonify(result)
+    
+    # The encoding depends on Accept, so caches must not mix them up
+    response.vary.add('Accept')
+    return response
+
+
+def step_response(simulation, extra=None):
+    """
+    Respond to a step. Clients passing ?since=<version> get only the stations
+    changed after that version, unless it is too old (or from another layout)
+    and a full snapshot is needed.
+    """
+    since = request.args.get('since', type=int)
+    layout = request.headers.get('X-Layout-Version') or request.args.get('layout')
+    changed = simulation.changes_since(since) if since is not None else None
+    if changed is None or (layout and layout != simulation.layout_id):
+        return station_response(simulation, extra)
+    
+    if wants_msgpack():
+        response = Response(encode_station_delta(simulation, changed, extra), mimetype=MSGPACK_MIMETYPE,
+                            headers={'X-Layout-Version': simulation.layout_id})
+    else:
+        response = jsonify(station_delta(simulation, changed, extra))
+    response.vary.add('Accept')
+    return response
+
+
+def stream_response(registry, hours, use_quantum):
+    """
+    Stream each simulated hour of the current session as soon as its step finishes,
+    as Server-Sent Events for EventSource clients and newline-delimited JSON otherwise.
+    A step that fails ends the stream with an error frame.
+    """
+    try:
+        bounded_int(hours, 'hours', 1, MAX_STREAM_HOURS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    sid = session_id()
+    use_sse = request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream']) == 'text/event-stream'
+    
+    def step_hours(frames, closed):
+        def put(frame):
+            # Wait for a slow client, but give up once it has gone away
+            while not closed.is_set():
+                try:
+                    frames.put(frame, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        try:
+            for offset in range(hours):
+                # The session (in shared-state mode, every worker's write lock) is
+                # held for one step at a time, never while waiting on the client
+                with registry.session(sid) as simulation:
+                    frame = ('data', json.dumps(simulation.simulate_hour(offset, use_quantum)))
+                if not put(frame):
+                    return
+        except Exception as e:
+            put(('error', json.dumps({'error': f'Simulation failed: {str(e)}'})))
+        put(None)
+    
+    def generate():
+        frames = queue.Queue(maxsize=STREAM_BUFFER_FRAMES)
+        closed = threading.Event()
+        threading.Thread(target=step_hours, args=(frames, closed), daemon=True).start()
+        try:
+            while True:
+                frame = frames.get()
+                if frame is None:
+                    break
+                event, body = frame
+                if use_sse:
+                    yield f"data: {body}\n\n" if event == 'data' else f"event: {event}\ndata: {body}\n\n"
+                else:
+                    yield body + "\n"
+        finally:
+            closed.set()
+    
+    return Response(generate(),
+                    mimetype='text/event-stream' if use_sse else 'application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def forecast_response(registry, hours):
+    """Respond with the current session's expected distribution the given number of hours ahead."""
+    with registry.session(session_id()) as simulation:
+        # Long horizons are only cheap on networks small enough for repeated squaring
+        try:
+            bounded_int(hours, 'hours', 0, simulation.max_forecast_hours())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(simulation.forecast(hours))
+
+
+def ensemble_response(registry, replicas, hours, use_quantum):
+    """
+    Respond with per-station statistics across independent replicas of the
+    current session; the live simulation state is not advanced. Quantum
+    replicas are fanned out to worker processes.
+    """
+    try:
+        bounded_int(replicas, 'replicas', 1, parallel.MAX_REPLICAS)
+        bounded_int(hours, 'hours', 1, parallel.MAX_HOURS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    with registry.session(session_id()) as simulation:
+        # Bounds both the histories' memory and the time the session is held
+        if replicas * hours * simulation.num_stations > parallel.MAX_HISTORY_ELEMENTS:
+            return jsonify({'error': 'ensemble too large: replicas x hours x stations must not exceed '
+                                     f'{parallel.MAX_HISTORY_ELEMENTS}'}), 400
+        if not use_quantum:
+            return jsonify(simulation.simulate_day_ensemble(replicas=replicas, hours=hours))
+        # Worker processes run on a copy, so the session isn't held while they do
+        template = copy.deepcopy(simulation)
+    
+    return jsonify(parallel.simulate_day_ensemble(template, replicas=replicas, hours=hours))